@@ -5,7 +5,8 @@ from sqlalchemy import pool
 
 from alembic import context
 
-from app.database import Base
+from app.database import Base, URL_DATABASE
+import app.models  # noqa: F401  registers the tables on Base.metadata
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -13,14 +14,18 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-if config.config_file_name is not None:
+# Skipped when embedded (a connection is passed in) to leave the caller's logging alone.
+if config.config_file_name is not None and "connection" not in config.attributes:
     fileConfig(config.config_file_name)
 
+# The app's URL_DATABASE wins over alembic.ini so migrations always run
+# against the same database as the app (% is escaped for configparser)
+if URL_DATABASE:
+    config.set_main_option("sqlalchemy.url", URL_DATABASE.replace("%", "%%"))
+
 # add your model's MetaData object here
 # for 'autogenerate' support
-# from myapp import mymodel
-# target_metadata = mymodel.Base.metadata
-target_metadata = None
+target_metadata = Base.metadata
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -46,6 +51,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        render_as_batch=True,
     )
 
     with context.begin_transaction():
@@ -59,15 +65,28 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    # Tests and scripts can hand over an open connection, see the Alembic cookbook
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        context.configure(
+            connection=connection, target_metadata=target_metadata, render_as_batch=True
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
+    # Only the URL is passed on: other sqlalchemy.* keys in alembic.ini (such
+    # as the stray sqlalchemy.ur) would reach create_engine() as arguments
     connectable = engine_from_config(
-        config.get_section(config.config_ini_section, {}),
+        {"sqlalchemy.url": config.get_main_option("sqlalchemy.url")},
         prefix="sqlalchemy.",
         poolclass=pool.NullPool,
     )
 
     with connectable.connect() as connection:
+        # Batch mode lets ALTER-style migrations run on SQLite too
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, render_as_batch=True
         )
 
         with context.begin_transaction():
@@ -0,0 +1,71 @@
+"""baseline schema
+
+Tables as created by Base.metadata.create_all before migrations existed.
+Databases that already have them are left untouched, so existing
+deployments can run `alembic upgrade head` without stamping first.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 20:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'users' not in existing:
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column('username', sa.String(15), nullable=False, unique=True),
+            sa.Column('email', sa.String(50), nullable=False, unique=True),
+            sa.Column('hashed_password', sa.String(500), nullable=False),
+        )
+        op.create_index('ix_users_id', 'users', ['id'], unique=True)
+    if 'movies' not in existing:
+        op.create_table(
+            'movies',
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column('title', sa.String(50), nullable=False),
+            sa.Column('author', sa.String(50), nullable=False),
+            sa.Column('release_date', sa.Date(), nullable=True),
+            sa.Column('created_by', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        )
+        op.create_index('ix_movies_id', 'movies', ['id'], unique=True)
+    if 'ratings' not in existing:
+        op.create_table(
+            'ratings',
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('movie_id', sa.Integer(), sa.ForeignKey('movies.id'), nullable=False),
+            sa.Column('rating', sa.Integer(), nullable=False),
+        )
+        op.create_index('ix_ratings_id', 'ratings', ['id'], unique=True)
+    if 'comments' not in existing:
+        op.create_table(
+            'comments',
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('movie_id', sa.Integer(), sa.ForeignKey('movies.id'), nullable=False),
+            sa.Column('comment', sa.String(500), nullable=False),
+            sa.Column('parent_id', sa.Integer(), sa.ForeignKey('comments.id'), nullable=True),
+        )
+        op.create_index('ix_comments_id', 'comments', ['id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_table('comments')
+    op.drop_table('ratings')
+    op.drop_table('movies')
+    op.drop_table('users')
@@ -0,0 +1,44 @@
+"""token version and revoked tokens
+
+Adds users.token_version (bumped by "log out everywhere") and the
+revoked_tokens table backing POST /logout.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 20:05:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    # create_all at app startup may already have made the new table
+    if 'token_version' not in {column['name'] for column in inspector.get_columns('users')}:
+        with op.batch_alter_table('users') as batch_op:
+            batch_op.add_column(sa.Column('token_version', sa.Integer(), nullable=False, server_default='0'))
+    if 'revoked_tokens' not in inspector.get_table_names():
+        op.create_table(
+            'revoked_tokens',
+            sa.Column('jti', sa.String(36), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+        )
+        op.create_index('ix_revoked_tokens_expires_at', 'revoked_tokens', ['expires_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_revoked_tokens_expires_at', table_name='revoked_tokens')
+    op.drop_table('revoked_tokens')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('token_version')
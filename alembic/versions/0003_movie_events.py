@@ -0,0 +1,44 @@
+"""movie events outbox
+
+Adds the movie_events table that GET /movie/{id}/events reads, so every
+worker sees the events published by the others.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 21:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # create_all at app startup may already have made the table
+    if 'movie_events' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'movie_events',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('type', sa.String(20), nullable=False),
+        sa.Column('data', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sqlite_autoincrement=True,
+    )
+    op.create_index('ix_movie_events_movie_id', 'movie_events', ['movie_id'])
+    op.create_index('ix_movie_events_created_at', 'movie_events', ['created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_movie_events_created_at', table_name='movie_events')
+    op.drop_index('ix_movie_events_movie_id', table_name='movie_events')
+    op.drop_table('movie_events')
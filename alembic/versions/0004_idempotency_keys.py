@@ -0,0 +1,40 @@
+"""idempotency keys
+
+Adds the idempotency_keys table behind the Idempotency-Key header on movie,
+rating and comment writes.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 21:40:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # create_all at app startup may already have made the table
+    if 'idempotency_keys' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('key', sa.String(255), primary_key=True),
+        sa.Column('fingerprint', sa.String(64), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column('response_body', sa.Text(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('idempotency_keys')
@@ -0,0 +1,44 @@
+"""movie updated_at
+
+Adds movies.updated_at, which GET /export/movies?since= filters on. Existing
+movies are stamped with the migration time so the next incremental export
+picks all of them up once.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 22:00:00
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    # create_all at app startup may already have made the column
+    if 'updated_at' not in {column['name'] for column in inspector.get_columns('movies')}:
+        # Nullable first so existing rows can be backfilled, then tightened
+        with op.batch_alter_table('movies') as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        movies = sa.table('movies', sa.column('updated_at', sa.DateTime()))
+        op.execute(movies.update().where(movies.c.updated_at.is_(None)).values(updated_at=datetime.utcnow()))
+        with op.batch_alter_table('movies') as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+    if 'ix_movies_updated_at' not in {index['name'] for index in inspector.get_indexes('movies')}:
+        op.create_index('ix_movies_updated_at', 'movies', ['updated_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_movies_updated_at', table_name='movies')
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.drop_column('updated_at')
@@ -1,76 +1,180 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import EmailStr
-from typing import Optional
-from jose import jwt
-import datetime
-from passlib.context import CryptContext
-from schemas import UserCreate, User, Token, TokenData
-from database import get_db
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-import crud as crud
-
+from typing import Dict, Optional
+from jose import jwt, JWTError
+from datetime import datetime, timedelta
+from passlib.context import CryptContext
+import threading
+import time
+import uuid
 import os
 from dotenv import load_dotenv
 
+import app.models as models
+import app.schemas as schemas
+import app.crud as crud
+from app.database import get_db
+
 load_dotenv()
 
 # Configuration
-# SECRET_KEY = "e2f65907d195806863bf8a8e5649974e655bfc5b0e33d3482fa2303870220c31"  # Change this to a secure key
-# ALGORITHM = "HS256"
-# ACCESS_TOKEN_EXPIRE_MINUTES = 15
+# SECRET_KEYS holds "kid:secret" pairs separated by commas. The first key signs
+# new tokens, the others are only accepted so tokens signed before a rotation
+# stay valid until they expire. A plain SECRET_KEY still works on its own.
+ALGORITHM = os.getenv('ALGORITHM', 'HS256')
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', 15))
+REVOCATION_REFRESH_SECONDS = float(os.getenv('REVOCATION_REFRESH_SECONDS', 30))
 
-SECRET_KEY = os.environ.get('SECRET_KEY')
-ALGORITHM = os.environ.get('ALGORITHM')
-ACCESS_TOKEN_EXPIRE_MINUTES = os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES')
 
-# Create an instance of CryptContext
+def load_signing_keys() -> Dict[str, str]:
+    keys = {}
+    for entry in os.getenv('SECRET_KEYS', '').split(','):
+        kid, sep, secret = entry.strip().partition(':')
+        if sep and kid and secret:
+            keys[kid] = secret
+    if not keys and os.getenv('SECRET_KEY'):
+        keys['default'] = os.getenv('SECRET_KEY')
+    return keys
+
+SIGNING_KEYS = load_signing_keys()
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# Utility functions
+
+# Password utilities
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
-def create_access_token(data: dict, expires_delta: Optional[datetime.timedelta] = None) -> str:
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.datetime.now(datetime.timezone.utc) + expires_delta
-    else:
-        expire = datetime.datetime.utcnow() + datetime.timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+
+class RevocationList:
+    """In-memory copy of revoked token ids and per-user token versions.
+
+    It is reloaded from the database at most every `refresh_seconds`, so a
+    logout handled by another worker takes effect within that window while
+    the common case (a valid token) never touches the database. Only one
+    request reloads at a time; the others keep checking against the current
+    copy meanwhile.
+    """
+
+    def __init__(self, refresh_seconds: float = REVOCATION_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.revoked_jtis = set()
+        self.user_versions: Dict[int, int] = {}
+        self.loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # Local revocations since the current reload started its read
+        self._recent_jtis = set()
+        self._recent_versions: Dict[int, int] = {}
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at >= self.refresh_seconds
+
+    def refresh(self, db: Session):
+        with self._lock:
+            self._recent_jtis, self._recent_versions = set(), {}
+        revoked, versions = crud.get_revocations(db, now=datetime.utcnow())
+        with self._lock:
+            # Re-apply what was revoked here while the read ran, as the read
+            # may have started before those commits
+            self.revoked_jtis = set(revoked) | self._recent_jtis
+            for user_id, version in self._recent_versions.items():
+                versions[user_id] = max(version, versions.get(user_id, 0))
+            self.user_versions = versions
+            self.loaded_at = time.monotonic()
+
+    def refresh_if_stale(self, db: Session):
+        if self.is_stale():
+            # Block only when there is nothing loaded to fall back on
+            if self._refresh_lock.acquire(blocking=self.loaded_at is None):
+                try:
+                    if self.is_stale():
+                        self.refresh(db)
+                finally:
+                    self._refresh_lock.release()
+
+    def revoke(self, jti: str):
+        with self._lock:
+            self.revoked_jtis.add(jti)
+            self._recent_jtis.add(jti)
+
+    def set_version(self, user_id: int, version: int):
+        with self._lock:
+            self.user_versions[user_id] = version
+            self._recent_versions[user_id] = version
+
+    def is_revoked(self, jti: str, user_id: int, version: int) -> bool:
+        return jti in self.revoked_jtis or version < self.user_versions.get(user_id, 0)
+
+    def clear(self):
+        with self._lock:
+            self.revoked_jtis = set()
+            self.user_versions = {}
+            self._recent_jtis, self._recent_versions = set(), {}
+            self.loaded_at = None
+
+revocation_list = RevocationList()
+
+
+# Token utilities
+def create_access_token(user: models.User, expires_delta: Optional[timedelta] = None) -> str:
+    if not SIGNING_KEYS:
+        raise RuntimeError("No signing key configured, set SECRET_KEY or SECRET_KEYS")
+    kid, secret = next(iter(SIGNING_KEYS.items()))
+    now = datetime.utcnow()
+    expire = now + (expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode = {
+        "sub": user.username,
+        "uid": user.id,
+        "ver": user.token_version or 0,
+        "jti": uuid.uuid4().hex,
+        "iat": now,
+        "exp": expire,
+    }
+    return jwt.encode(to_encode, secret, algorithm=ALGORITHM, headers={"kid": kid})
 
 def decode_access_token(token: str) -> dict:
+    """Verify the signature and expiry of a token, raising JWTError otherwise."""
+    kid = jwt.get_unverified_header(token).get("kid")
+    secret = SIGNING_KEYS.get(kid)
+    if secret is None:
+        raise JWTError("Unknown signing key")
+    return jwt.decode(token, secret, algorithms=[ALGORITHM])
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> schemas.TokenData:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-# API Router
-router = APIRouter()
-
-@router.post("/signup", response_model=Token)
-async def signup(user: UserCreate, db: Session = Depends(get_db)):
-    if crud.get_user_by_username(db, user.username):
-        raise HTTPException(status_code=400, detail="Username already registered")
-    hashed_password = hash_password(user.password)
-    db_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    access_token = create_access_token({"sub": user.username})
-    return {"access_token": access_token, "token_type": "bearer"}
-
-@router.post("/login", response_model=Token)
-async def login(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, user.username)
-    if not db_user or not verify_password(user.password, db_user.hashed_password):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    access_token = create_access_token({"sub": user.username})
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+        payload = decode_access_token(token)
+        current_user = schemas.TokenData(
+            username=payload["sub"],
+            id=payload["uid"],
+            version=payload["ver"],
+            jti=payload["jti"],
+            expires_at=datetime.utcfromtimestamp(payload["exp"]),
+        )
+    except (JWTError, KeyError, ValueError):
+        raise credentials_exception
+
+    # The session is only used when the revocation list is due for a reload
+    revocation_list.refresh_if_stale(db)
+    if revocation_list.is_revoked(current_user.jti, current_user.id, current_user.version):
+        raise credentials_exception
+
+    return current_user
+
+def logout(db: Session, current_user: schemas.TokenData):
+    crud.revoke_token(db, current_user.jti, current_user.id, current_user.expires_at)
+    revocation_list.revoke(current_user.jti)
+
+def logout_everywhere(db: Session, current_user: schemas.TokenData):
+    version = crud.bump_token_version(db, current_user.id)
+    revocation_list.set_version(current_user.id, version)
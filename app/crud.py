@@ -1,9 +1,13 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, load_only
 from fastapi import HTTPException, status
 import app.models as models
 import app.schemas as schemas   
+import app.events as events
 from passlib.context import CryptContext
-from typing import Optional
+from typing import Optional, List, Tuple
+from datetime import datetime
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -25,6 +29,33 @@ def create_user(db: Session, user: schemas.UserCreate):
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
+def get_user(db: Session, user_id: int):
+    return db.query(models.User).filter(models.User.id == user_id).first()
+
+
+# Token revocation
+def revoke_token(db: Session, jti: str, user_id: int, expires_at: datetime):
+    db.add(models.RevokedToken(jti=jti, user_id=user_id, expires_at=expires_at))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Already revoked through another worker
+        db.rollback()
+
+def bump_token_version(db: Session, user_id: int) -> int:
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    version = user.token_version = (user.token_version or 0) + 1
+    # Read before the commit expires it, saving a reload
+    db.commit()
+    return version
+
+def get_revocations(db: Session, now: datetime):
+    revoked = [jti for (jti,) in db.query(models.RevokedToken.jti).filter(models.RevokedToken.expires_at > now)]
+    versions = dict(db.query(models.User.id, models.User.token_version).filter(models.User.token_version > 0).all())
+    return revoked, versions
+
 
 
 
@@ -47,8 +78,86 @@ def update_movie(db: Session, movie_id: int, movie_update: schemas.MoviesUpdate,
     db.refresh(movie)
     return movie
 
-def get_movies(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.Movie).offset(skip).limit(limit).all()
+def only_columns(query, model, fields: Optional[List[str]]):
+    """Restrict the SELECT to `fields` (the primary key is always loaded)."""
+    if fields:
+        query = query.options(load_only(*[getattr(model, field) for field in fields]))
+    return query
+
+def rating_stats(db: Session):
+    """Per-movie ratings_count and average_rating, as a subquery to outer join on movie_id."""
+    return (
+        db.query(
+            models.Rating.movie_id,
+            func.count(models.Rating.id).label("ratings_count"),
+            func.avg(models.Rating.rating).label("average_rating"),
+        )
+        .group_by(models.Rating.movie_id)
+        .subquery()
+    )
+
+def comment_counts(db: Session):
+    """Per-movie comments_count, as a subquery to outer join on movie_id."""
+    return (
+        db.query(models.Comment.movie_id, func.count(models.Comment.id).label("comments_count"))
+        .group_by(models.Comment.movie_id)
+        .subquery()
+    )
+
+def with_rating_stats(db: Session, query):
+    stats = rating_stats(db)
+    return query.outerjoin(stats, stats.c.movie_id == models.Movie.id).add_columns(
+        func.coalesce(stats.c.ratings_count, 0).label("ratings_count"),
+        stats.c.average_rating.label("average_rating"),
+    )
+
+def with_comment_counts(db: Session, query):
+    comments = comment_counts(db)
+    return query.outerjoin(comments, comments.c.movie_id == models.Movie.id).add_columns(
+        func.coalesce(comments.c.comments_count, 0).label("comments_count"),
+    )
+
+def get_movies(db: Session, skip: int = 0, limit: int = 10, fields: Optional[List[str]] = None, include: Optional[List[str]] = None):
+    """List movies, or (movie, aggregates...) rows when `include` asks for stats/comments_count."""
+    query = only_columns(db.query(models.Movie), models.Movie, fields)
+    if include:
+        if "stats" in include:
+            query = with_rating_stats(db, query)
+        if "comments_count" in include:
+            query = with_comment_counts(db, query)
+    return query.offset(skip).limit(limit).all()
+
+def export_movies(db: Session, since: Optional[datetime] = None, batch_size: int = 1000):
+    """Stream every movie with its rating stats and comment count, in id order.
+
+    yield_per fetches `batch_size` rows at a time through a server-side cursor
+    (where the driver supports one), so memory stays flat whatever the size
+    of the catalogue.
+
+    `since` is inclusive. MySQL DATETIME has whole-second precision, so with
+    a strict comparison a client passing the last updated_at it saw would
+    miss movies changed later in that same second; re-sending a row is
+    harmless, missing one is not.
+    """
+    query = db.query(
+        models.Movie.id,
+        models.Movie.title,
+        models.Movie.author,
+        models.Movie.release_date,
+        models.Movie.created_by,
+        models.Movie.updated_at,
+    )
+    query = with_comment_counts(db, with_rating_stats(db, query))
+    if since is not None:
+        query = query.filter(models.Movie.updated_at >= since)
+    return query.order_by(models.Movie.id).yield_per(batch_size)
+
+def touch_movie(db: Session, movie_id: int) -> bool:
+    """Bump a movie's updated_at, returning False if there is no such movie."""
+    updated = db.query(models.Movie).filter(models.Movie.id == movie_id).update(
+        {models.Movie.updated_at: datetime.utcnow()}, synchronize_session=False
+    )
+    return updated > 0
 
 
 def create_movie(db: Session, movie: schemas.MoviesCreate, current_user_id: int):
@@ -65,6 +174,18 @@ def create_movie(db: Session, movie: schemas.MoviesCreate, current_user_id: int)
 def get_movie(db: Session, movie_id: int):
     return db.query(models.Movie).filter(models.Movie.id == movie_id).first()
 
+def get_movies_by_ids(db: Session, movie_ids: List[int]):
+    """Load many movies with a single IN query, keyed by id (missing ids are absent)."""
+    if not movie_ids:
+        return {}
+    movies = db.query(models.Movie).filter(models.Movie.id.in_(movie_ids)).all()
+    return {movie.id: movie for movie in movies}
+
+def get_scored_movies(db: Session, scored: List[Tuple[int, float]]):
+    """Attach movies to (movie_id, score) pairs, dropping movies deleted since scoring."""
+    found = get_movies_by_ids(db, [movie_id for movie_id, _ in scored])
+    return [{"movie": found[movie_id], "score": score} for movie_id, score in scored if movie_id in found]
+
 
 
 
@@ -76,22 +197,22 @@ def get_movie(db: Session, movie_id: int):
 
 # Rating CRUD operations
 def create_rating(db: Session, user_id: int, movie_id: int, rating: int):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    movie = db.query(models.Movie).filter(models.Movie.id == movie_id).first()
-    if not movie:
+    # user_id comes from a validated token; bumping updated_at doubles as the existence check
+    if not touch_movie(db, movie_id):
+        db.rollback()
         raise HTTPException(status_code=404, detail="Movie not found")
 
     new_rating = models.Rating(user_id=user_id, movie_id=movie_id, rating=rating)
     db.add(new_rating)
+    # Flushed for its id, so the event commits together with the rating
+    db.flush()
+    events.record(db, movie_id, "rating", schemas.RatingListItem.model_validate(new_rating).model_dump(mode="json"))
     db.commit()
     db.refresh(new_rating)
     return new_rating
 
-def get_ratings(db: Session, user_id: Optional[int] = None, movie_id: Optional[int] = None):
-    query = db.query(models.Rating)
+def get_ratings(db: Session, user_id: Optional[int] = None, movie_id: Optional[int] = None, fields: Optional[List[str]] = None):
+    query = only_columns(db.query(models.Rating), models.Rating, fields)
     
     if user_id is not None:
         query = query.filter(models.Rating.user_id == user_id)
@@ -106,13 +227,16 @@ def get_ratings(db: Session, user_id: Optional[int] = None, movie_id: Optional[i
 def create_comment(db: Session, user_id: int, movie_id: int, comment: str, parent_id: Optional[int] = None):
     db_comment = models.Comment(user_id=user_id, movie_id=movie_id, comment=comment, parent_id=parent_id)
     db.add(db_comment)
+    touch_movie(db, movie_id)
+    db.flush()
+    events.record(db, movie_id, "reply" if parent_id else "comment", schemas.CommentListItem.model_validate(db_comment).model_dump(mode="json"))
     db.commit()
     db.refresh(db_comment)
     print(f"Created comment: {db_comment}")  # Debug log
     return db_comment
 
-def get_comment(db: Session, user_id: Optional[int] = None, movie_id: Optional[int] = None):
-    query = db.query(models.Comment)
+def get_comment(db: Session, user_id: Optional[int] = None, movie_id: Optional[int] = None, fields: Optional[List[str]] = None):
+    query = only_columns(db.query(models.Comment), models.Comment, fields)
     if user_id is not None:
         query = query.filter(models.Comment.user_id == user_id)
     if movie_id is not None:
@@ -123,10 +247,6 @@ def get_comment(db: Session, user_id: Optional[int] = None, movie_id: Optional[i
 
 
 def reply_to_comment(db: Session, user_id: int, comment_id: int, comment: str):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     parent_comment = db.query(models.Comment).filter(models.Comment.id == comment_id).first()
     if not parent_comment:
         raise HTTPException(status_code=404, detail=f"Comment with ID {comment_id} not found")
@@ -138,6 +258,9 @@ def reply_to_comment(db: Session, user_id: int, comment_id: int, comment: str):
         parent_id=parent_comment.id
     )
     db.add(new_comment)
+    touch_movie(db, parent_comment.movie_id)
+    db.flush()
+    events.record(db, new_comment.movie_id, "reply", schemas.CommentListItem.model_validate(new_comment).model_dump(mode="json"))
     db.commit()
     db.refresh(new_comment)
     return new_comment
\ No newline at end of file
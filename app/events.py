@@ -0,0 +1,280 @@
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from typing import Callable, Deque, Dict, List, Optional, Set
+import asyncio
+import json
+import threading
+import time
+import os
+from dotenv import load_dotenv
+
+import app.models as models
+from app.database import SessionLocal
+from app.logger import getLogger
+
+load_dotenv()
+
+logger = getLogger(__name__)
+
+# Configuration
+SSE_BUFFER_SIZE = int(os.getenv('SSE_BUFFER_SIZE', 100))
+SSE_HISTORY_SIZE = int(os.getenv('SSE_HISTORY_SIZE', 500))
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+# Streams are closed after this long; EventSource reconnects with Last-Event-ID
+SSE_STREAM_SECONDS = float(os.getenv('SSE_STREAM_SECONDS', 300))
+# How often each worker reads new events from the movie_events table
+SSE_POLL_SECONDS = float(os.getenv('SSE_POLL_SECONDS', 0.5))
+# How long a missing id is waited for before it is skipped, see OutboxBroker.poll
+SSE_GAP_SECONDS = float(os.getenv('SSE_GAP_SECONDS', 2))
+# Events older than this are pruned from the table
+SSE_RETENTION_SECONDS = float(os.getenv('SSE_RETENTION_SECONDS', 60 * 60))
+
+# Rows read per poll
+POLL_BATCH_ROWS = 1000
+
+
+@dataclass
+class Event:
+    id: int
+    movie_id: int
+    type: str
+    data: dict
+
+    def encode(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class Subscription:
+    """One client's view of a movie's events, with a bounded buffer.
+
+    When a client falls more than `buffer_size` events behind, the oldest
+    events are dropped; the gap is visible in the event ids.
+    """
+
+    def __init__(self, broker: "Broker", movie_id: int, loop: asyncio.AbstractEventLoop, buffer_size: int):
+        self.broker = broker
+        self.movie_id = movie_id
+        self.buffer: Deque[Event] = deque(maxlen=buffer_size)
+        self.last_id = 0
+        self._lock = threading.Lock()
+        # Subscriptions are opened in the threadpool; the asyncio.Event is
+        # made on the loop by the first wait()
+        self._loop = loop
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def push(self, event: Event):
+        # Called from the poller thread, so wake the loop thread-safely
+        with self._lock:
+            # A replayed event can also arrive live; send it once
+            if event.id <= self.last_id:
+                return
+            self.last_id = event.id
+            self.buffer.append(event)
+        self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def drain(self) -> List[Event]:
+        with self._lock:
+            events = list(self.buffer)
+            self.buffer.clear()
+        if self._wakeup is not None:
+            self._wakeup.clear()
+        return events
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait for new events, returning False if none arrived within `timeout`."""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self.buffer:
+            return True
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """Subscriptions held by this process, grouped by movie.
+
+    Implementations deliver events with `_deliver`; OutboxBroker is the one
+    the app uses.
+    """
+
+    def __init__(self, buffer_size: int = SSE_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._subscribers: Dict[int, Set[Subscription]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def _deliver(self, event: Event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(event.movie_id, ()))
+        for subscription in subscribers:
+            subscription.push(event)
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers[subscription.movie_id].discard(subscription)
+            if not self._subscribers[subscription.movie_id]:
+                del self._subscribers[subscription.movie_id]
+
+
+def record(db: Session, movie_id: int, event_type: str, data: dict) -> models.MovieEvent:
+    """Add an event to the caller's transaction; it is published once that commits."""
+    row = models.MovieEvent(movie_id=movie_id, type=event_type, data=json.dumps(data), created_at=datetime.utcnow())
+    db.add(row)
+    return row
+
+def _from_row(row: models.MovieEvent) -> Event:
+    return Event(row.id, row.movie_id, row.type, json.loads(row.data))
+
+class OutboxBroker(Broker):
+    """Movie events shared by all workers through the movie_events table.
+
+    Writes add their event to the movie_events table in their own
+    transaction (see record()), so an event is stored exactly when the change
+    it describes commits, and ids come from the database and are ordered
+    across processes. Each process runs one poller thread, started
+    by the first subscription, which reads the new rows and fans them out to
+    that process's subscribers. Resuming from a Last-Event-ID replays from
+    the table, so it works on whichever worker the client reconnects to.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], poll_seconds: float = SSE_POLL_SECONDS,
+                 buffer_size: int = SSE_BUFFER_SIZE, history_size: int = SSE_HISTORY_SIZE):
+        super().__init__(buffer_size)
+        self.history_size = history_size
+        self.session_factory = session_factory
+        self.poll_seconds = poll_seconds
+        self._cursor: Optional[int] = None
+        self._gap_since: Optional[float] = None
+        self._pruned_at = 0.0
+        # Held while reading and fanning out, so a subscription's replay
+        # cannot interleave with a poll
+        self._poll_lock = threading.Lock()
+        self._poller: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def publish(self, movie_id: int, event_type: str, data: dict) -> Event:
+        """Commit an event on its own session, for writers without one."""
+        db = self.session_factory()
+        try:
+            row = record(db, movie_id, event_type, data)
+            db.flush()
+            event = _from_row(row)
+            db.commit()
+            return event
+        finally:
+            db.close()
+
+    def _start(self, db: Session):
+        # Live delivery starts from the newest event at the time
+        if self._cursor is None:
+            self._cursor = db.query(func.max(models.MovieEvent.id)).scalar() or 0
+        if self._poller is None:
+            self._poller = threading.Thread(target=self._run, name="movie-events-poller", daemon=True)
+            self._poller.start()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Polling movie events failed")
+
+    def poll(self):
+        """Fan out the events published (by any process) since the last poll."""
+        with self._poll_lock:
+            if self._cursor is None:
+                return
+            db = self.session_factory()
+            try:
+                rows = db.query(models.MovieEvent).filter(models.MovieEvent.id > self._cursor) \
+                    .order_by(models.MovieEvent.id).limit(POLL_BATCH_ROWS).all()
+                new_events = [_from_row(row) for row in rows]
+            finally:
+                db.close()
+            for event in new_events:
+                if event.id != self._cursor + 1:
+                    # A lower id may belong to a transaction that has not
+                    # committed yet; wait for it before skipping the gap
+                    now = time.monotonic()
+                    if self._gap_since is None:
+                        self._gap_since = now
+                    if now - self._gap_since < SSE_GAP_SECONDS:
+                        break
+                self._gap_since = None
+                self._cursor = event.id
+                self._deliver(event)
+        # Outside the lock: on SQLite the DELETE may queue for the writer
+        self._prune()
+
+    def _prune(self):
+        if time.monotonic() - self._pruned_at < SSE_RETENTION_SECONDS / 10:
+            return
+        self._pruned_at = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(seconds=SSE_RETENTION_SECONDS)
+        db = self.session_factory()
+        try:
+            db.query(models.MovieEvent).filter(models.MovieEvent.created_at < cutoff).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def subscribe(self, movie_id: int, loop: asyncio.AbstractEventLoop, last_event_id: Optional[int] = None) -> Subscription:
+        """Open a subscription whose events wake `loop`; this queries the
+        database, so call it from a worker thread."""
+        subscription = Subscription(self, movie_id, loop, self.buffer_size)
+        with self._poll_lock:
+            db = self.session_factory()
+            try:
+                self._start(db)
+                with self._lock:
+                    self._subscribers[movie_id].add(subscription)
+                if last_event_id is not None:
+                    # Everything up to the cursor; later events come from polls
+                    rows = db.query(models.MovieEvent).filter(
+                        models.MovieEvent.movie_id == movie_id,
+                        models.MovieEvent.id > last_event_id,
+                        models.MovieEvent.id <= self._cursor,
+                    ).order_by(models.MovieEvent.id.desc()).limit(self.history_size).all()
+                    for row in reversed(rows):
+                        subscription.push(_from_row(row))
+            finally:
+                db.close()
+        return subscription
+
+    def close(self):
+        """Stop the poller thread."""
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join()
+            self._poller = None
+
+broker = OutboxBroker(SessionLocal)
+
+
+async def stream(subscription: Subscription, request, stream_seconds: Optional[float] = None):
+    """Yield server-sent event frames until the client leaves or the stream times out."""
+    deadline = time.monotonic() + (SSE_STREAM_SECONDS if stream_seconds is None else stream_seconds)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            for event in subscription.drain():
+                yield event.encode()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or await request.is_disconnected():
+                break
+            if not await subscription.wait(min(SSE_HEARTBEAT_SECONDS, remaining)):
+                yield ": keep-alive\n\n"
+    finally:
+        subscription.close()
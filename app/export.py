@@ -0,0 +1,55 @@
+from typing import Iterable, Iterator
+from datetime import date, datetime
+from decimal import Decimal
+import csv
+import io
+import json
+import zlib
+
+EXPORT_COLUMNS = [
+    "id", "title", "author", "release_date", "created_by", "updated_at",
+    "ratings_count", "average_rating", "comments_count",
+]
+
+# Rows encoded per chunk handed to the response
+CHUNK_ROWS = 500
+
+
+def _values(row) -> list:
+    values = []
+    for value in row:
+        if isinstance(value, (date, datetime)):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = float(value)
+        values.append(value)
+    return values
+
+def _chunks(rows: Iterable) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ndjson(rows: Iterable) -> Iterator[bytes]:
+    for chunk in _chunks(rows):
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, _values(row)))) + "\n" for row in chunk).encode()
+
+def gzip_csv(rows: Iterable) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in _chunks(rows):
+        writer.writerows(_values(row) for row in chunk)
+        data = compressor.compress(buffer.getvalue().encode())
+        buffer.seek(0)
+        buffer.truncate()
+        if data:
+            yield data
+    yield compressor.compress(buffer.getvalue().encode()) + compressor.flush()
@@ -0,0 +1,185 @@
+from collections import OrderedDict
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import Callable, NamedTuple, Optional
+from datetime import datetime, timedelta
+import hashlib
+import json
+import threading
+import time
+import os
+from dotenv import load_dotenv
+
+import app.models as models
+
+load_dotenv()
+
+# Configuration
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000))
+# An unfinished claim older than this is taken to belong to a crashed request
+# and is handed to the next one; keep it above the worker timeout
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv('IDEMPOTENCY_LEASE_SECONDS', 120))
+# How often expired keys are deleted from the table
+IDEMPOTENCY_PRUNE_SECONDS = float(os.getenv('IDEMPOTENCY_PRUNE_SECONDS', 10 * 60))
+
+# Longest key the idempotency_keys table can store
+MAX_KEY_LENGTH = models.IdempotencyKey.key.type.length
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: int
+    body: str
+
+
+def fingerprint(method: str, path: str, payload) -> str:
+    """Hash of the request a key was first used with, to catch reused keys."""
+    body = payload.model_dump_json() if payload is not None else ""
+    return hashlib.sha256(f"{method} {path}\n{body}".encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Remembers the response of writes sent with an Idempotency-Key header.
+
+    Completed responses live in a bounded in-memory TTL map in front of the
+    idempotency_keys table, which makes keys durable and shared between
+    workers. A key is claimed with an INSERT before the write runs, so a retry
+    that races the original request gets a 409 instead of a duplicate. A claim
+    only holds for `lease_seconds` while unfinished, so a request that crashed
+    does not block its key for the whole TTL.
+    """
+
+    def __init__(self, ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS, max_entries: int = IDEMPOTENCY_CACHE_SIZE,
+                 lease_seconds: float = IDEMPOTENCY_LEASE_SECONDS, prune_seconds: float = IDEMPOTENCY_PRUNE_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lease_seconds = lease_seconds
+        self.prune_seconds = prune_seconds
+        self._pruned_at: Optional[float] = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, user_id: int, key: str) -> Optional[StoredResponse]:
+        with self._lock:
+            entry = self._cache.get((user_id, key))
+            if entry is None:
+                return None
+            expires_at, stored = entry
+            if expires_at <= time.monotonic():
+                del self._cache[(user_id, key)]
+                return None
+            return stored
+
+    def _remember(self, user_id: int, key: str, stored: StoredResponse, created_at: datetime):
+        remaining = self.ttl_seconds - (datetime.utcnow() - created_at).total_seconds()
+        with self._lock:
+            self._cache[(user_id, key)] = (time.monotonic() + remaining, stored)
+            self._cache.move_to_end((user_id, key))
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _prune(self, db: Session, now: datetime):
+        """Delete expired keys, at most once every `prune_seconds` per process."""
+        with self._lock:
+            if self._pruned_at is not None and time.monotonic() - self._pruned_at < self.prune_seconds:
+                return
+            self._pruned_at = time.monotonic()
+        db.query(models.IdempotencyKey).filter(
+            models.IdempotencyKey.created_at <= now - timedelta(seconds=self.ttl_seconds)
+        ).delete(synchronize_session=False)
+        db.commit()
+
+    def _claim(self, db: Session, user_id: int, key: str, request_fingerprint: str) -> Optional[models.IdempotencyKey]:
+        """Claim the key, or return the row of the request that holds it."""
+        now = datetime.utcnow()
+        self._prune(db, now)
+        existing = db.query(models.IdempotencyKey).filter(
+            models.IdempotencyKey.user_id == user_id, models.IdempotencyKey.key == key
+        ).first()
+        if existing is None:
+            db.add(models.IdempotencyKey(user_id=user_id, key=key, fingerprint=request_fingerprint, created_at=now))
+            try:
+                db.commit()
+                return None
+            except IntegrityError:
+                # Claimed by a concurrent request in the meantime
+                db.rollback()
+                return self._claim(db, user_id, key, request_fingerprint)
+
+        expired = existing.created_at <= now - timedelta(seconds=self.ttl_seconds)
+        abandoned = existing.status_code is None and existing.created_at <= now - timedelta(seconds=self.lease_seconds)
+        if not (expired or abandoned):
+            return existing
+        # Take the key over; matching created_at makes sure only one request does
+        taken = db.query(models.IdempotencyKey).filter(
+            models.IdempotencyKey.user_id == user_id,
+            models.IdempotencyKey.key == key,
+            models.IdempotencyKey.created_at == existing.created_at,
+        ).update({
+            models.IdempotencyKey.fingerprint: request_fingerprint,
+            models.IdempotencyKey.created_at: now,
+            models.IdempotencyKey.status_code: None,
+            models.IdempotencyKey.response_body: None,
+        }, synchronize_session=False)
+        db.commit()
+        if not taken:
+            return self._claim(db, user_id, key, request_fingerprint)
+        return None
+
+    def _release(self, db: Session, user_id: int, key: str):
+        db.rollback()
+        db.query(models.IdempotencyKey).filter(
+            models.IdempotencyKey.user_id == user_id, models.IdempotencyKey.key == key
+        ).delete()
+        db.commit()
+
+    def run(self, db: Session, user_id: int, key: Optional[str], request_fingerprint: str,
+            status_code: int, create: Callable[[], dict]):
+        """Run `create` at most once per key and return its JSON response.
+
+        Without a key this is just `create()`. A repeated key replays the stored
+        response, and a key reused with a different request body is rejected,
+        as is an empty key or one too long for the idempotency_keys table.
+        """
+        if key is None:
+            return JSONResponse(create(), status_code=status_code)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+
+        stored = self._cached(user_id, key)
+        if stored is None:
+            existing = self._claim(db, user_id, key, request_fingerprint)
+            if existing is not None:
+                if existing.status_code is None and existing.fingerprint == request_fingerprint:
+                    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A request with this Idempotency-Key is still in progress")
+                stored = StoredResponse(existing.fingerprint, existing.status_code, existing.response_body)
+                if existing.status_code is not None:
+                    self._remember(user_id, key, stored, existing.created_at)
+
+        if stored is not None:
+            if stored.fingerprint != request_fingerprint:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Idempotency-Key was already used with a different request")
+            return JSONResponse(json.loads(stored.body), status_code=stored.status_code, headers={"Idempotent-Replayed": "true"})
+
+        try:
+            content = create()
+        except Exception:
+            self._release(db, user_id, key)
+            raise
+        body = json.dumps(content)
+        row = db.query(models.IdempotencyKey).filter(
+            models.IdempotencyKey.user_id == user_id, models.IdempotencyKey.key == key
+        ).first()
+        row.status_code, row.response_body = status_code, body
+        db.commit()
+        self._remember(user_id, key, StoredResponse(request_fingerprint, status_code, body), row.created_at)
+        return JSONResponse(content, status_code=status_code)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+store = IdempotencyStore()
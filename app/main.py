@@ -1,14 +1,21 @@
-from fastapi import FastAPI, HTTPException, status, Depends
+from fastapi import FastAPI, HTTPException, status, Depends, Header, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
-import app.models as models, app.schemas as schemas, app.crud as crud
+import app.schemas as schemas, app.crud as crud
 from app.database import get_db, engine, Base
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from passlib.context import CryptContext
-from jose import jwt, JWTError
-from datetime import timedelta, datetime
+from fastapi.security import OAuth2PasswordRequestForm
+from datetime import timedelta, datetime, timezone
+import asyncio
 import os
 from dotenv import load_dotenv
+from app.auth import get_current_user, create_access_token, verify_password, ACCESS_TOKEN_EXPIRE_MINUTES
+import app.auth as auth
+from app.recommender import recommender, SIMILAR_MOVIES_K
+import app.events as events
+import app.idempotency as idempotency
+import app.export as export
 
 from app.logger import getLogger
 
@@ -18,10 +25,28 @@ logger = getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Configuration for JWT
-SECRET_KEY = os.getenv('SECRET_KEY')
-ALGORITHM = os.getenv('ALGORITHM')
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', 15))
+# Upper bound on ids resolved by GET /movies/batch
+MAX_BATCH_IDS = int(os.getenv('MAX_BATCH_IDS', 100))
+
+# Columns clients may pick with `fields=` and aggregates they may add with `include=`
+MOVIE_FIELDS = ["id", "title", "author", "release_date", "created_by"]
+RATING_FIELDS = ["id", "user_id", "movie_id", "rating"]
+COMMENT_FIELDS = ["id", "user_id", "movie_id", "comment", "parent_id"]
+MOVIE_INCLUDES = {"stats": ["ratings_count", "average_rating"], "comments_count": ["comments_count"]}
+
+def parse_list(value: Optional[str], allowed, name: str) -> Optional[List[str]]:
+    if not value:
+        return None
+    items = list(dict.fromkeys(item.strip() for item in value.split(",") if item.strip()))
+    unknown = [item for item in items if item not in allowed]
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Unknown {name}: {', '.join(unknown)}")
+    return items
+
+def sparse(obj, fields: List[str], extras=None) -> dict:
+    item = {field: getattr(obj, field) for field in fields}
+    item.update(extras or {})
+    return item
 
 # FastAPI app instance
 app = FastAPI()
@@ -29,45 +54,6 @@ app = FastAPI()
 # Create database tables
 Base.metadata.create_all(engine)
 
-# Security setup
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def hash_password(password: str):
-    hashed = pwd_context.hash(password)
-    print(f"Hashed Password: {hashed}")   
-    return hashed
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    user = crud.get_user_by_username(db, username=username)
-    if user is None:
-        raise credentials_exception
-
-    return user
-
 @app.get("/", tags=["Home"])
 def home():
     return {"message":"Welcome to my first API service"}
@@ -93,29 +79,64 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
         logger.warning("Failed login attempt")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(data={"sub": user.username}, expires_delta=access_token_expires)
+    access_token = create_access_token(user, expires_delta=access_token_expires)
     logger.info("Login succesful")
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.post("/logout", status_code=status.HTTP_204_NO_CONTENT, tags=["User"])
+def logout(db: Session = Depends(get_db), current_user: schemas.TokenData = Depends(get_current_user)):
+    auth.logout(db, current_user)
+
+@app.post("/logout/all", status_code=status.HTTP_204_NO_CONTENT, tags=["User"])
+def logout_everywhere(db: Session = Depends(get_db), current_user: schemas.TokenData = Depends(get_current_user)):
+    auth.logout_everywhere(db, current_user)
+
 
 
 # Movies endpoints
-@app.get("/movies/", response_model=List[schemas.Movie], tags=["Movies"])
-async def get_movies(skip: int = 0, limit: int = 10,
+@app.get("/movies/", response_model=List[schemas.MovieListItem], response_model_exclude_unset=True, tags=["Movies"])
+async def get_movies(skip: int = 0, limit: int = 10, fields: Optional[str] = None, include: Optional[str] = None,
     db: Session = Depends(get_db)):
-    movies = crud.get_movies(db, skip=skip, limit=limit)
-    return movies
+    selected = parse_list(fields, MOVIE_FIELDS, "fields")
+    included = parse_list(include, MOVIE_INCLUDES, "include")
+    movies = crud.get_movies(db, skip=skip, limit=limit, fields=selected, include=included)
+    if not selected and not included:
+        return movies
+    columns = selected or MOVIE_FIELDS
+    if not included:
+        return [sparse(movie, columns) for movie in movies]
+    aggregates = [name for option in included for name in MOVIE_INCLUDES[option]]
+    return [sparse(row[0], columns, {name: getattr(row, name) for name in aggregates}) for row in movies]
 
 @app.post("/movie/", response_model=schemas.Movie, status_code=status.HTTP_201_CREATED, tags=["Movies"])
 async def create_movie(
     movie: schemas.MoviesCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: schemas.TokenData = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
+    def create():
+        try:
+            created = crud.create_movie(db=db, movie=movie, current_user_id=current_user.id)
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        return schemas.Movie.model_validate(created, from_attributes=True).model_dump(mode="json")
+    return idempotency.store.run(db, current_user.id, idempotency_key, idempotency.fingerprint("POST", "/movie/", movie),
+        status.HTTP_201_CREATED, create)
+
+@app.get("/movies/batch", response_model=schemas.MovieBatch, tags=["Movies"])
+def get_movies_batch(ids: str, db: Session = Depends(get_db)):
     try:
-        return crud.create_movie(db=db, movie=movie, current_user_id=current_user.id)
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        movie_ids = list(dict.fromkeys(int(movie_id) for movie_id in ids.split(",") if movie_id.strip()))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="ids must be a comma separated list of integers")
+    if len(movie_ids) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    found = crud.get_movies_by_ids(db, movie_ids)
+    return {
+        "movies": [found[movie_id] for movie_id in movie_ids if movie_id in found],
+        "missing": [movie_id for movie_id in movie_ids if movie_id not in found],
+    }
 
 @app.get("/movie/{movie_id}", response_model=schemas.Movie, tags=["Movies"])
 async def get_movie(movie_id: int, db: Session = Depends(get_db)):
@@ -124,12 +145,41 @@ async def get_movie(movie_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
     return movie
 
+@app.get("/movie/{movie_id}/similar", response_model=List[schemas.ScoredMovie], tags=["Movies"])
+def get_similar_movies(movie_id: int, limit: int = Query(10, ge=1, le=SIMILAR_MOVIES_K), db: Session = Depends(get_db)):
+    if not crud.get_movie(db, movie_id=movie_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
+    similar = recommender.get_model(db).similar(movie_id, limit=limit)
+    return crud.get_scored_movies(db, similar)
+
+@app.get("/movie/{movie_id}/events", tags=["Movies"])
+async def movie_events(movie_id: int, request: Request, last_event_id: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    resume_from = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    loop = asyncio.get_running_loop()
+
+    def subscribe():
+        try:
+            if not crud.get_movie(db, movie_id=movie_id):
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
+        finally:
+            # The stream can stay open for minutes; don't hold a pooled connection for it
+            db.close()
+        return events.broker.subscribe(movie_id, loop, last_event_id=resume_from)
+
+    # Both query the database, so keep them off the event loop
+    subscription = await run_in_threadpool(subscribe)
+    return StreamingResponse(
+        events.stream(subscription, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.put("/movies/{movie_id}", response_model=schemas.Movie, tags=["Movies"] )
 async def update_movie(
     movie_id: int,
     movie_update: schemas.MoviesUpdate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: schemas.TokenData = Depends(get_current_user)
 ):
     movie = crud.update_movie(db, movie_id, movie_update, current_user.id)
     if movie is None:
@@ -137,41 +187,86 @@ async def update_movie(
     return movie
 
 @app.delete("/movies/{movie_id}", response_model=schemas.Movie, tags=["Movies"] )
-def delete_movie(movie_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def delete_movie(movie_id: int, db: Session = Depends(get_db), current_user: schemas.TokenData = Depends(get_current_user)):
     return crud.delete_movie(db, movie_id, current_user.id)
 
 
 
+# Export endpoints
+@app.get("/export/movies", tags=["Export"])
+def export_movies(format: str = "ndjson", since: Optional[datetime] = None, db: Session = Depends(get_db)):
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="format must be ndjson or csv")
+    if since is not None and since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def rows():
+        # The body streams after get_db may already have closed the session;
+        # a closed session just checks out a new connection, released here
+        try:
+            yield from crud.export_movies(db, since=since)
+        finally:
+            db.close()
+
+    if format == "csv":
+        return StreamingResponse(export.gzip_csv(rows()), media_type="application/gzip",
+            headers={"Content-Disposition": "attachment; filename=movies.csv.gz"})
+    return StreamingResponse(export.ndjson(rows()), media_type="application/x-ndjson")
+
+
+
 # Rating endpoints
 @app.post("/ratings/", response_model=schemas.Rating, tags=["Movies"], status_code=status.HTTP_201_CREATED)
 async def create_rating(
     rating: schemas.RatingCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: schemas.TokenData = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    return crud.create_rating(db, user_id=current_user.id, movie_id=rating.movie_id, rating=rating.rating)
-
-@app.get("/ratings/", tags=["Movies"])
-async def read_ratings(user_id: Optional[int] = None, movie_id: Optional[int] = None, db: Session = Depends(get_db)):
-    return crud.get_ratings(db, user_id=user_id, movie_id=movie_id)
+    return idempotency.store.run(db, current_user.id, idempotency_key, idempotency.fingerprint("POST", "/ratings/", rating),
+        status.HTTP_201_CREATED,
+        lambda: schemas.Rating.model_validate(
+            crud.create_rating(db, user_id=current_user.id, movie_id=rating.movie_id, rating=rating.rating)
+        ).model_dump(mode="json"))
+
+@app.get("/ratings/", response_model=List[schemas.RatingListItem], response_model_exclude_unset=True, tags=["Movies"])
+async def read_ratings(user_id: Optional[int] = None, movie_id: Optional[int] = None, fields: Optional[str] = None, db: Session = Depends(get_db)):
+    selected = parse_list(fields, RATING_FIELDS, "fields")
+    ratings = crud.get_ratings(db, user_id=user_id, movie_id=movie_id, fields=selected)
+    return [sparse(rating, selected) for rating in ratings] if selected else ratings
+
+@app.get("/users/{user_id}/recommendations", response_model=List[schemas.ScoredMovie], tags=["Movies"])
+def get_recommendations(user_id: int, limit: int = Query(10, ge=1, le=SIMILAR_MOVIES_K), db: Session = Depends(get_db)):
+    if not crud.get_user(db, user_id=user_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    rated = {rating.movie_id: rating.rating for rating in crud.get_ratings(db, user_id=user_id)}
+    recommended = recommender.get_model(db).recommend(rated, limit=limit)
+    return crud.get_scored_movies(db, recommended)
 
 # Comment endpoints
 @app.post("/comments/", tags=["Movies"], status_code=201)
 async def create_comment(
     comment: schemas.CommentCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: schemas.TokenData = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    return crud.create_comment(db, user_id=current_user.id, movie_id=comment.movie_id, comment=comment.comment)
+    return idempotency.store.run(db, current_user.id, idempotency_key, idempotency.fingerprint("POST", "/comments/", comment),
+        status.HTTP_201_CREATED,
+        lambda: schemas.CommentListItem.model_validate(
+            crud.create_comment(db, user_id=current_user.id, movie_id=comment.movie_id, comment=comment.comment)
+        ).model_dump(mode="json"))
 
 
-@app.get("/comments/", tags=["Movies"])
-async def read_comments(user_id: Optional[int] = None, movie_id: Optional[int] = None, db: Session = Depends(get_db)):
-    return crud.get_comment(db, user_id=user_id, movie_id=movie_id)
+@app.get("/comments/", response_model=List[schemas.CommentListItem], response_model_exclude_unset=True, tags=["Movies"])
+async def read_comments(user_id: Optional[int] = None, movie_id: Optional[int] = None, fields: Optional[str] = None, db: Session = Depends(get_db)):
+    selected = parse_list(fields, COMMENT_FIELDS, "fields")
+    comments = crud.get_comment(db, user_id=user_id, movie_id=movie_id, fields=selected)
+    return [sparse(comment, selected) for comment in comments] if selected else comments
 
 
 
 
 @app.post("/comments/reply/", tags=["Movies"])
-def create_reply(reply: schemas.ReplyCreate, db: Session = Depends(get_db), current_user: int = Depends(get_current_user)):
+def create_reply(reply: schemas.ReplyCreate, db: Session = Depends(get_db), current_user: schemas.TokenData = Depends(get_current_user)):
     return crud.reply_to_comment(db, user_id=current_user.id, comment_id=reply.comment_id, comment=reply.comment)
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, String, Integer, ForeignKey, Date
+from sqlalchemy import Boolean, Column, String, Integer, ForeignKey, Date, DateTime, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -13,6 +13,8 @@ class User(Base):
     username = Column(String(15), nullable=False, unique=True)
     email = Column(String(50), nullable=False, unique=True)
     hashed_password = Column(String(500), nullable=False)
+    # Bumped to invalidate every token issued to the user ("log out everywhere")
+    token_version = Column(Integer, nullable=False, default=0, server_default='0')
 
     movies = relationship("Movie", back_populates="creator")
 
@@ -24,6 +26,8 @@ class Movie(Base):
     author = Column(String(50), nullable=False)
     release_date = Column(Date, nullable=True)
     created_by = Column(Integer, ForeignKey('users.id'), nullable=False)
+    # Also bumped by new ratings and comments, so exports can be incremental
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     creator = relationship("User", back_populates="movies")
     ratings = relationship("Rating", back_populates="movie")
@@ -51,4 +55,38 @@ class Comment(Base):
     
     user = relationship("User")
     movie = relationship("Movie", back_populates="comments")
-    parent = relationship("Comment", remote_side=[id], backref='replies')
\ No newline at end of file
+    parent = relationship("Comment", remote_side=[id], backref='replies')
+
+class RevokedToken(Base):
+    __tablename__ = 'revoked_tokens'
+
+    jti = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    # Both stay NULL while the first request is still being processed
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+
+
+# Outbox of movie events shared by every worker, see app/events.py
+class MovieEvent(Base):
+    __tablename__ = 'movie_events'
+    # Without AUTOINCREMENT SQLite reuses ids once pruning empties the table,
+    # and pollers holding the old maximum would skip the new events
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    # Assigned by the database, so ids are ordered across processes
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    movie_id = Column(Integer, nullable=False, index=True)
+    type = Column(String(20), nullable=False)
+    data = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, index=True)
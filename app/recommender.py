@@ -0,0 +1,195 @@
+import numpy as np
+import scipy.sparse as sp
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+import time
+import os
+from dotenv import load_dotenv
+
+import app.models as models
+from app.database import SessionLocal
+from app.logger import getLogger
+
+load_dotenv()
+
+logger = getLogger(__name__)
+
+# Configuration
+SIMILAR_MOVIES_K = int(os.getenv('SIMILAR_MOVIES_K', 50))
+RECOMMENDER_REFRESH_SECONDS = float(os.getenv('RECOMMENDER_REFRESH_SECONDS', 600))
+
+# Size (in cells) of the dense similarity block scored at once while building
+BLOCK_CELLS = 4_000_000
+# Ratings fetched per round trip while loading them from the database
+LOAD_CHUNK_ROWS = 10_000
+
+
+class SimilarityModel:
+    """Top-k item-item neighbours computed from the user x movie rating matrix.
+
+    Similarity is the cosine between movies' rating vectors after each user's
+    mean rating is subtracted. Only the k best neighbours of every movie are
+    kept, as two (n_movies, k) arrays; missing neighbours are padded with -1.
+    """
+
+    def __init__(self, movie_ids: np.ndarray, neighbours: np.ndarray, scores: np.ndarray):
+        self.movie_ids = movie_ids
+        self.neighbours = neighbours
+        self.scores = scores
+        self.index = {int(movie_id): i for i, movie_id in enumerate(movie_ids)}
+
+    @classmethod
+    def build(cls, user_ids, movie_ids, ratings, k: int = SIMILAR_MOVIES_K) -> "SimilarityModel":
+        """Build from parallel arrays of ratings, later entries replacing earlier ones."""
+        user_ids = np.asarray(user_ids)
+        movie_ids = np.asarray(movie_ids)
+        ratings = np.asarray(ratings, dtype=np.float32)
+
+        users, user_idx = np.unique(user_ids, return_inverse=True)
+        movies, movie_idx = np.unique(movie_ids, return_inverse=True)
+        n_users, n_movies = len(users), len(movies)
+        if n_movies == 0:
+            empty = np.empty((0, k))
+            return cls(movies, empty.astype(np.int32), empty.astype(np.float32))
+
+        # Keep the latest rating when a user rated the same movie twice
+        keys = user_idx.astype(np.int64) * n_movies + movie_idx
+        _, latest = np.unique(keys[::-1], return_index=True)
+        latest = len(keys) - 1 - latest
+        user_idx, movie_idx, ratings = user_idx[latest], movie_idx[latest], ratings[latest]
+
+        # Centre each user's ratings on their mean, then L2-normalise every movie
+        user_means = np.bincount(user_idx, weights=ratings, minlength=n_users) / np.bincount(user_idx, minlength=n_users)
+        centred = ratings - user_means[user_idx]
+        matrix = sp.csr_matrix((centred, (movie_idx, user_idx)), shape=(n_movies, n_users), dtype=np.float32)
+        matrix.eliminate_zeros()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        matrix = sp.diags(1 / norms).dot(matrix).tocsr().astype(np.float32)
+        transposed = matrix.T.tocsc()
+
+        k = min(k, n_movies - 1) if n_movies > 1 else 0
+        neighbours = np.full((n_movies, k), -1, dtype=np.int32)
+        scores = np.zeros((n_movies, k), dtype=np.float32)
+        step = max(1, BLOCK_CELLS // n_movies)
+        for start in range(0, n_movies, step):
+            stop = min(start + step, n_movies)
+            block = matrix[start:stop].dot(transposed).toarray()
+            block[np.arange(stop - start), np.arange(start, stop)] = 0
+            if k == 0:
+                continue
+            top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            # Unrelated movies (no co-ratings) are not neighbours
+            top[top_scores <= 0] = -1
+            top_scores[top_scores <= 0] = 0
+            neighbours[start:stop] = top
+            scores[start:stop] = top_scores
+        return cls(movies, neighbours, scores)
+
+    @classmethod
+    def from_db(cls, db: Session, k: int = SIMILAR_MOVIES_K) -> "SimilarityModel":
+        """Stream the ratings table into NumPy arrays, `LOAD_CHUNK_ROWS` rows at a time."""
+        query = select(models.Rating.user_id, models.Rating.movie_id, models.Rating.rating).order_by(models.Rating.id)
+        user_ids, movie_ids, ratings = [], [], []
+        for chunk in db.execute(query.execution_options(yield_per=LOAD_CHUNK_ROWS)).partitions():
+            columns = np.array(chunk, dtype=np.int64)
+            user_ids.append(columns[:, 0])
+            movie_ids.append(columns[:, 1])
+            ratings.append(columns[:, 2].astype(np.float32))
+        if not user_ids:
+            return cls.build([], [], [], k=k)
+        return cls.build(np.concatenate(user_ids), np.concatenate(movie_ids), np.concatenate(ratings), k=k)
+
+    def similar(self, movie_id: int, limit: int = 10) -> List[Tuple[int, float]]:
+        i = self.index.get(movie_id)
+        if i is None:
+            return []
+        neighbours, scores = self.neighbours[i, :limit], self.scores[i, :limit]
+        found = neighbours >= 0
+        return list(zip(self.movie_ids[neighbours[found]].tolist(), scores[found].tolist()))
+
+    def recommend(self, rated: Dict[int, float], limit: int = 10) -> List[Tuple[int, float]]:
+        """Score unseen movies by the similarity-weighted, mean-centred ratings of `rated`."""
+        known = [(self.index[movie_id], rating) for movie_id, rating in rated.items() if movie_id in self.index]
+        if not known or self.neighbours.shape[1] == 0:
+            return []
+        rows = np.array([i for i, _ in known])
+        weights = np.array([rating for _, rating in known], dtype=np.float32)
+        weights -= weights.mean()
+        if not weights.any():
+            # All ratings equal: treat every rated movie as liked
+            weights[:] = 1
+
+        neighbours = self.neighbours[rows]
+        contributions = self.scores[rows] * weights[:, None]
+        found = neighbours >= 0
+        totals = np.bincount(neighbours[found], weights=contributions[found], minlength=len(self.movie_ids))
+        totals[rows] = 0
+        candidates = np.flatnonzero(totals > 0)
+        best = candidates[np.argsort(-totals[candidates], kind="stable")[:limit]]
+        return list(zip(self.movie_ids[best].tolist(), totals[best].tolist()))
+
+
+class Recommender:
+    """Holds the current SimilarityModel and rebuilds it on a schedule.
+
+    The model is rebuilt from the ratings table when it is older than
+    `refresh_seconds`. With a `session_factory` the rebuild runs in a
+    background thread on its own session and the new model is swapped in when
+    ready, so requests keep answering from the previous model meanwhile. Only
+    the very first build, when there is no model yet, runs in the request.
+    """
+
+    def __init__(self, refresh_seconds: float = RECOMMENDER_REFRESH_SECONDS,
+                 session_factory: Optional[Callable[[], Session]] = None):
+        self.refresh_seconds = refresh_seconds
+        self.session_factory = session_factory
+        self.model: Optional[SimilarityModel] = None
+        self.built_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def is_stale(self) -> bool:
+        return self.built_at is None or time.monotonic() - self.built_at >= self.refresh_seconds
+
+    def refresh(self, db: Session):
+        model = SimilarityModel.from_db(db)
+        self.model, self.built_at = model, time.monotonic()
+
+    def _refresh_in_background(self):
+        try:
+            db = self.session_factory()
+            try:
+                self.refresh(db)
+            finally:
+                db.close()
+        except Exception:
+            logger.exception("Rebuilding the similarity model failed")
+        finally:
+            self._lock.release()
+
+    def get_model(self, db: Session) -> SimilarityModel:
+        if self.is_stale():
+            # Block only when there is no model to fall back on
+            if self._lock.acquire(blocking=self.model is None):
+                if not self.is_stale():
+                    self._lock.release()
+                elif self.model is not None and self.session_factory is not None:
+                    # The thread releases the lock once the new model is in
+                    threading.Thread(target=self._refresh_in_background, daemon=True).start()
+                else:
+                    try:
+                        self.refresh(db)
+                    finally:
+                        self._lock.release()
+        return self.model
+
+    def clear(self):
+        self.model, self.built_at = None, None
+
+recommender = Recommender(session_factory=SessionLocal)
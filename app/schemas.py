@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, ConfigDict
 from typing import Optional, List
-from datetime import date
+from datetime import date, datetime
 
 # User Schemas
 from pydantic import BaseModel
@@ -23,7 +23,10 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
-    id: Optional[str] = None
+    id: Optional[int] = None
+    version: int = 0
+    jti: Optional[str] = None
+    expires_at: Optional[datetime] = None
 
 # Movie Schemas
 
@@ -45,6 +48,31 @@ class Movie(MovieBase):
     class Config:
         orm_mode = True
 
+# Sparse list items: every field is optional so `fields=` can leave any of
+# them out; endpoints serialise them with response_model_exclude_unset
+
+class MovieListItem(BaseModel):
+    id: Optional[int] = None
+    title: Optional[str] = None
+    author: Optional[str] = None
+    release_date: Optional[date] = None
+    created_by: Optional[int] = None
+    ratings_count: Optional[int] = None
+    average_rating: Optional[float] = None
+    comments_count: Optional[int] = None
+
+    model_config = ConfigDict(
+        from_attributes=True
+    )
+
+class MovieBatch(BaseModel):
+    movies: List[Movie]
+    missing: List[int]
+
+class ScoredMovie(BaseModel):
+    movie: Movie
+    score: float
+
 # Rating Schemas
 
 class RatingBase(BaseModel):
@@ -62,6 +90,16 @@ class Rating(RatingBase):
         from_attributes=True
     )
 
+class RatingListItem(BaseModel):
+    id: Optional[int] = None
+    user_id: Optional[int] = None
+    movie_id: Optional[int] = None
+    rating: Optional[int] = None
+
+    model_config = ConfigDict(
+        from_attributes=True
+    )
+
 # Comment Schemas
 
 class CommentBase(BaseModel):
@@ -81,4 +119,15 @@ class ReplyCreate(BaseModel):
 class Comment(CommentBase):
     model_config = ConfigDict(
         from_attributes=True
-    )
\ No newline at end of file
+    )
+
+class CommentListItem(BaseModel):
+    id: Optional[int] = None
+    user_id: Optional[int] = None
+    movie_id: Optional[int] = None
+    comment: Optional[str] = None
+    parent_id: Optional[int] = None
+
+    model_config = ConfigDict(
+        from_attributes=True
+    )
@@ -0,0 +1,76 @@
+"""Authenticated requests per second: DB lookup per request vs stateless tokens.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_auth [requests]
+
+"before" is the old get_current_user (decode, then load the user by username),
+"after" is app.auth.get_current_user, which only reads the token claims and
+the in-memory revocation list.
+"""
+import os
+import sys
+import tempfile
+import time
+
+_db_file = os.path.join(tempfile.mkdtemp(), "bench_auth.db")
+os.environ.setdefault("URL_DATABASE", f"sqlite:///{_db_file}")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from jose import JWTError
+from sqlalchemy.orm import Session
+
+import app.auth as auth
+import app.crud as crud
+import app.schemas as schemas
+from app.database import Base, SessionLocal, engine, get_db
+
+
+def legacy_current_user(token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
+    try:
+        username = auth.decode_access_token(token).get("sub")
+    except JWTError:
+        raise HTTPException(status_code=401)
+    user = crud.get_user_by_username(db, username=username)
+    if user is None:
+        raise HTTPException(status_code=401)
+    return user
+
+
+bench_app = FastAPI()
+
+@bench_app.get("/before")
+def before(current_user=Depends(legacy_current_user)):
+    return {"id": current_user.id}
+
+@bench_app.get("/after")
+def after(current_user=Depends(auth.get_current_user)):
+    return {"id": current_user.id}
+
+
+def run(client, path, headers, requests):
+    for _ in range(min(50, requests)):
+        client.get(path, headers=headers)
+    start = time.perf_counter()
+    for _ in range(requests):
+        assert client.get(path, headers=headers).status_code == 200
+    return requests / (time.perf_counter() - start)
+
+
+def main(requests=2000):
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    user = crud.get_user_by_username(db, "bench") or crud.create_user(
+        db, schemas.UserCreate(username="bench", password="bench", email="bench@example.com"))
+    headers = {"Authorization": f"Bearer {auth.create_access_token(user)}"}
+    db.close()
+
+    client = TestClient(bench_app)
+    for path in ("/before", "/after"):
+        print(f"{path[1:]:>6}: {run(client, path, headers, requests):8.0f} req/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
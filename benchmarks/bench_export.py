@@ -0,0 +1,74 @@
+"""Rows per second and peak memory of the catalogue export.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_export [movies]
+
+Seeds a throwaway SQLite database with `movies` movies (10 ratings and 2
+comments each), then drains crud.export_movies through both encoders. Peak
+Python memory is reported for the full catalogue and for a tenth of it; with
+streaming the two stay close.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+
+_db_file = os.path.join(tempfile.mkdtemp(), "bench_export.db")
+os.environ.setdefault("URL_DATABASE", f"sqlite:///{_db_file}")
+
+import app.crud as crud
+import app.export as export
+import app.models as models
+from app.database import Base, SessionLocal, engine
+
+
+def seed(movies):
+    Base.metadata.create_all(engine)
+    rng = random.Random(0)
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        connection.execute(models.User.__table__.insert(), [
+            {"id": 1, "username": "bench", "email": "bench@example.com", "hashed_password": "x", "token_version": 0}])
+        connection.execute(models.Movie.__table__.insert(), [
+            {"id": i, "title": f"Movie {i}", "author": "Author", "release_date": date(2020, 1, 1),
+             "created_by": 1, "updated_at": now} for i in range(1, movies + 1)])
+        connection.execute(models.Rating.__table__.insert(), [
+            {"user_id": 1, "movie_id": i, "rating": rng.randint(1, 5)} for i in range(1, movies + 1) for _ in range(10)])
+        connection.execute(models.Comment.__table__.insert(), [
+            {"user_id": 1, "movie_id": i, "comment": "Seeded"} for i in range(1, movies + 1) for _ in range(2)])
+
+
+def drain(encoder, limit=None, trace=False):
+    db = SessionLocal()
+    rows = crud.export_movies(db)
+    if limit is not None:
+        rows = (row for row, _ in zip(rows, range(limit)))
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    size = sum(len(chunk) for chunk in encoder(rows))
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    db.close()
+    return elapsed, peak, size
+
+
+def main(movies=100_000):
+    seed(movies)
+    for name, encoder in (("ndjson", export.ndjson), ("csv.gz", export.gzip_csv)):
+        elapsed, _, size = drain(encoder)
+        _, peak, _ = drain(encoder, trace=True)
+        _, small_peak, _ = drain(encoder, limit=movies // 10, trace=True)
+        print(f"{name:>7}: {movies / elapsed:9.0f} rows/s   {size / 1e6:6.1f} MB   "
+              f"peak {peak / 1e6:5.1f} MB ({small_peak / 1e6:5.1f} MB for {movies // 10} rows)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
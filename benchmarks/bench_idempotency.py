@@ -0,0 +1,62 @@
+"""Overhead of Idempotency-Key handling on POST /comments/.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_idempotency [requests]
+
+Compares plain writes, writes with a fresh key (claim + store), and retries
+answered from the in-memory map or from the idempotency_keys table.
+"""
+import os
+import sys
+import tempfile
+import time
+
+_db_file = os.path.join(tempfile.mkdtemp(), "bench_idempotency.db")
+os.environ.setdefault("URL_DATABASE", f"sqlite:///{_db_file}")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+from fastapi.testclient import TestClient
+
+import app.auth as auth
+import app.crud as crud
+import app.idempotency as idempotency
+import app.schemas as schemas
+from app.database import SessionLocal
+from app.main import app
+
+
+def timed(client, requests, headers_for, before_each=None):
+    start = time.perf_counter()
+    for i in range(requests):
+        if before_each:
+            before_each()
+        response = client.post("/comments/", json={"movie_id": 1, "comment": "Benchmark"}, headers=headers_for(i))
+        assert response.status_code == 201, response.text
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main(requests=500):
+    db = SessionLocal()
+    user = crud.get_user_by_username(db, "bench") or crud.create_user(
+        db, schemas.UserCreate(username="bench", password="bench", email="bench@example.com"))
+    crud.get_movie(db, 1) or crud.create_movie(
+        db, schemas.MoviesCreate(title="Bench", author="Bench", release_date="2020-01-01"), user.id)
+    auth_header = {"Authorization": f"Bearer {auth.create_access_token(user)}"}
+    db.close()
+
+    client = TestClient(app)
+    run = f"{time.time():.0f}"
+    results = {
+        "no key": timed(client, requests, lambda i: auth_header),
+        "new key": timed(client, requests, lambda i: {**auth_header, "Idempotency-Key": f"{run}-{i}"}),
+        "replay (memory)": timed(client, requests, lambda i: {**auth_header, "Idempotency-Key": f"{run}-{i}"}),
+        "replay (database)": timed(client, requests, lambda i: {**auth_header, "Idempotency-Key": f"{run}-{i}"},
+                                   before_each=idempotency.store.clear),
+    }
+    for name, micros in results.items():
+        print(f"{name:>18}: {micros:8.0f} us/request")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
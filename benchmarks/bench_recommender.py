@@ -0,0 +1,63 @@
+"""Build time and query latency of the item-item similarity model.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_recommender [ratings] [users] [movies]
+
+Ratings are synthetic: movie popularity follows a Zipf-like curve and each
+rating is 1-5, so the matrix is as skewed as a real catalogue.
+"""
+import os
+import sys
+import time
+
+# app.recommender imports the models, which need a database URL to import
+os.environ.setdefault("URL_DATABASE", "sqlite://")
+
+import numpy as np
+
+from app.recommender import SimilarityModel
+
+
+def synthetic_ratings(n_ratings, n_users, n_movies, seed=0):
+    rng = np.random.default_rng(seed)
+    popularity = 1 / np.arange(1, n_movies + 1) ** 0.8
+    user_ids = rng.integers(1, n_users + 1, n_ratings)
+    movie_ids = rng.choice(np.arange(1, n_movies + 1), n_ratings, p=popularity / popularity.sum())
+    ratings = rng.integers(1, 6, n_ratings)
+    return user_ids, movie_ids, ratings
+
+
+def percentiles(samples):
+    p50, p99 = np.percentile(np.array(samples) * 1e6, [50, 99])
+    return f"p50 {p50:7.1f} us   p99 {p99:7.1f} us"
+
+
+def main(n_ratings=1_000_000, n_users=100_000, n_movies=10_000, queries=2000):
+    user_ids, movie_ids, ratings = synthetic_ratings(n_ratings, n_users, n_movies)
+
+    start = time.perf_counter()
+    model = SimilarityModel.build(user_ids, movie_ids, ratings)
+    print(f"build: {time.perf_counter() - start:6.2f} s for {n_ratings} ratings "
+          f"({n_users} users x {n_movies} movies), k={model.neighbours.shape[1]}")
+
+    rng = np.random.default_rng(1)
+    samples = []
+    for movie_id in rng.integers(1, n_movies + 1, queries):
+        start = time.perf_counter()
+        model.similar(int(movie_id))
+        samples.append(time.perf_counter() - start)
+    print(f"similar:         {percentiles(samples)}")
+
+    samples = []
+    for user_id in rng.integers(1, n_users + 1, queries):
+        mask = user_ids == user_id
+        rated = dict(zip(movie_ids[mask].tolist(), ratings[mask].tolist()))
+        start = time.perf_counter()
+        model.recommend(rated)
+        samples.append(time.perf_counter() - start)
+    print(f"recommendations: {percentiles(samples)}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:4]))
@@ -0,0 +1,101 @@
+"""Concurrent read/write throughput on SQLite, default engine vs the SQLite profile.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_sqlite [seconds] [readers] [writers]
+
+"before" is a plain create_engine() on the database file, as database.py did
+before the profile; "after" uses create_sqlite_engines with RoutingSession.
+Readers fetch a random movie with its rating stats, writers insert ratings
+one commit at a time. Failed operations ("database is locked") are counted.
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("URL_DATABASE", "sqlite://")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.crud as crud
+import app.database as database
+import app.models as models
+
+MOVIES = 1000
+
+
+def seed(engine):
+    database.Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(models.User.__table__.insert(), [
+            {"id": 1, "username": "bench", "email": "bench@example.com", "hashed_password": "x", "token_version": 0}])
+        connection.execute(models.Movie.__table__.insert(), [
+            {"id": i, "title": f"Movie {i}", "author": "Author", "created_by": 1} for i in range(1, MOVIES + 1)])
+
+
+def run(session_factory, seconds, readers, writers):
+    deadline = time.monotonic() + seconds
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def loop(operation):
+        rng = random.Random()
+        done = errors = 0
+        while time.monotonic() < deadline:
+            db = session_factory()
+            try:
+                operation(db, rng.randint(1, MOVIES))
+                done += 1
+            except Exception:
+                errors += 1
+            finally:
+                db.close()
+        return done, errors
+
+    def read(db, movie_id):
+        query = crud.with_rating_stats(db, db.query(models.Movie)).filter(models.Movie.id == movie_id)
+        query.first()
+
+    def write(db, movie_id):
+        db.add(models.Rating(user_id=1, movie_id=movie_id, rating=3))
+        db.commit()
+
+    def worker(kind, operation):
+        done, errors = loop(operation)
+        with lock:
+            counts[kind] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=worker, args=("reads", read)) for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=("writes", write)) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {name: count / seconds for name, count in counts.items()}
+
+
+def main(seconds=5.0, readers=8, writers=4):
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'before.db')}"
+    before_engine = create_engine(url, connect_args={"check_same_thread": False})
+    seed(before_engine)
+    before = run(sessionmaker(bind=before_engine), seconds, readers, writers)
+
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'after.db')}"
+    writer, reader = database.create_sqlite_engines(url)
+    seed(writer)
+    after = run(sessionmaker(bind=writer, class_=database.RoutingSession, info={"read_engine": reader}),
+                seconds, readers, writers)
+
+    print(f"{readers} readers, {writers} writers, {seconds:.0f} s")
+    for name, result in (("before", before), ("after", after)):
+        print(f"{name:>6}: {result['reads']:8.0f} reads/s {result['writes']:7.0f} writes/s {result['errors']:6.1f} errors/s")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(float(args[0]) if args else 5.0, *(int(arg) for arg in args[1:3]))
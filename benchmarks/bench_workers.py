@@ -0,0 +1,90 @@
+"""Throughput of the gunicorn entrypoint across worker counts.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_workers [seconds] [worker counts...]
+
+Starts gunicorn with gunicorn.conf.py against a throwaway SQLite database for
+each worker count and hammers GET /movies/ from a pool of client threads.
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+CLIENT_THREADS = 8
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not come up at {url}")
+
+
+def hammer(url, seconds):
+    deadline = time.monotonic() + seconds
+
+    def worker():
+        done = 0
+        with httpx.Client() as client:
+            while time.monotonic() < deadline:
+                try:
+                    client.get(url).raise_for_status()
+                except httpx.TransportError:
+                    # A worker recycled by max_requests drops its keep-alive connections
+                    continue
+                done += 1
+        return done
+
+    with ThreadPoolExecutor(CLIENT_THREADS) as pool:
+        return sum(pool.map(lambda _: worker(), range(CLIENT_THREADS))) / seconds
+
+
+def run(workers, seconds):
+    port = free_port()
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        WEB_CONCURRENCY=str(workers),
+        GUNICORN_ACCESS_LOG="/dev/null",
+        URL_DATABASE=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_workers.db')}",
+        SECRET_KEY=os.getenv("SECRET_KEY", "benchmark-secret"),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app.main:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}/movies/"
+        wait_until_up(url)
+        return hammer(url, seconds)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(seconds=5.0, worker_counts=(1, 2, 4)):
+    print(f"cpus: {os.cpu_count()}")
+    for workers in worker_counts:
+        print(f"{workers:>2} workers: {run(workers, seconds):8.0f} req/s")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(float(args[0]) if args else 5.0, tuple(int(n) for n in args[1:]) or (1, 2, 4))
@@ -1,2 +1,2 @@
 alembic upgrade head
-uvicorn app.main:app --host 0.0.0.0 --port ${PORT}PORT
\ No newline at end of file
+gunicorn -c gunicorn.conf.py app.main:app
\ No newline at end of file
@@ -0,0 +1,71 @@
+# Production entrypoint: gunicorn managing uvicorn workers
+#
+#   gunicorn -c gunicorn.conf.py app.main:app
+#
+# Every setting can be overridden through the environment, e.g. WEB_CONCURRENCY=4.
+import math
+import os
+
+
+def available_cpus():
+    """CPUs this process may actually use: its affinity mask, further limited
+    by a container's cgroup CPU quota. cpu_count() sees every core of the host."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:  # cgroup v2: "<quota> <period>" or "max <period>"
+            quota, period = f.read().split()
+    except OSError:
+        try:  # cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                quota = f.read().strip()
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = f.read().strip()
+        except OSError:
+            return cpus
+    if quota not in ('max', '-1'):
+        cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    return cpus
+
+
+# Server socket
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# Workers: one async worker per available core keeps every core busy without
+# oversubscribing them. Each worker has its own DB pool, event poller and copy
+# of the similarity model, hence the cap. The worker comes from the
+# uvicorn-worker package, which replaces the deprecated uvicorn.workers module
+worker_class = "uvicorn_worker.UvicornWorker"
+workers = int(os.getenv('WEB_CONCURRENCY', min(available_cpus(), int(os.getenv('GUNICORN_MAX_WORKERS', 8)))))
+
+# Load the app once in the master so workers share its memory pages and start
+# faster. The engine pool is disposed in post_fork so no child reuses a
+# connection opened by the master.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# Recycle workers periodically to cap slow leaks; the jitter keeps them from
+# all restarting at the same moment
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Timeouts
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Logging
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    # Only import here: without preload the app is loaded after the fork
+    if preload_app:
+        from app.database import engine, read_engine
+        # close=False leaves the master's connections alone and just gives
+        # this worker a fresh pool (read_engine is engine except on SQLite)
+        engine.dispose(close=False)
+        read_engine.dispose(close=False)
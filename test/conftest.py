@@ -0,0 +1,41 @@
+import os
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Lazy relationship loads raise during tests, see app/database.py
+os.environ.setdefault("RAISE_ON_LAZY_LOAD", "1")
+
+
+class QueryCounter:
+    """Records every SQL statement sent to any engine while the block runs.
+
+        with QueryCounter() as queries:
+            client.get("/movies/")
+        assert queries.count == 1, queries
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, "before_cursor_execute", self._record)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def __repr__(self):
+        return f"{self.count} statements:\n" + "\n".join(self.statements)
+
+
+@pytest.fixture
+def count_queries():
+    return QueryCounter
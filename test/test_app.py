@@ -135,6 +135,29 @@ def test_get_movies(client):
     for i in range(3):
         assert f"Movie {i}" in response_titles
 
+def test_get_movies_sparse_fields(client):
+    response = client.get("/movies/?fields=id,title")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) > 0
+    assert all(set(movie) == {"id", "title"} for movie in data)
+
+    response = client.get("/movies/?fields=id,secret")
+    assert response.status_code == 422
+
+def test_get_movies_batch(client):
+    first_id = test_create_movie(client)
+    second_id = test_create_movie(client)
+
+    response = client.get(f"/movies/batch?ids={second_id},999999,{first_id},{second_id}")
+    assert response.status_code == 200
+    data = response.json()
+    assert [movie["id"] for movie in data["movies"]] == [second_id, first_id]
+    assert data["missing"] == [999999]
+
+    response = client.get("/movies/batch?ids=1,abc")
+    assert response.status_code == 422
+
 def test_post_rating(client):
     token = test_login(client)
 
@@ -179,6 +202,22 @@ def test_get_ratings(client):
     assert len(data) > 0
     assert all(rating["movie_id"] == movie_id for rating in data)
 
+def test_get_movies_include_stats(client):
+    token = test_login(client)
+    movie_id = test_create_movie(client)
+    for rating in (2, 4):
+        client.post("/ratings/", json={"movie_id": movie_id, "rating": rating}, headers={"Authorization": f"Bearer {token}"})
+    client.post("/comments/", json={"movie_id": movie_id, "comment": "Counted"}, headers={"Authorization": f"Bearer {token}"})
+
+    response = client.get("/movies/?fields=id&include=stats,comments_count&limit=1000")
+    assert response.status_code == 200
+    movie = next(movie for movie in response.json() if movie["id"] == movie_id)
+    assert movie == {"id": movie_id, "ratings_count": 2, "average_rating": 3.0, "comments_count": 1}
+
+    response = client.get(f"/ratings/?movie_id={movie_id}&fields=rating")
+    assert response.status_code == 200
+    assert sorted(response.json(), key=lambda rating: rating["rating"]) == [{"rating": 2}, {"rating": 4}]
+
 def test_post_comment(client):
     token = test_login(client)
     movie_id = test_create_movie(client)
@@ -214,3 +253,628 @@ def test_get_comments(client):
     data = response.json()
     assert isinstance(data, list) and len(data) > 0
     assert all(comment["movie_id"] == movie_id for comment in data)
+
+def test_token_signed_with_rotated_key(client, monkeypatch):
+    import app.auth as auth
+    old_token = test_login(client)
+
+    # A new signing key takes over, the old one is kept for verification only
+    monkeypatch.setattr(auth, "SIGNING_KEYS", {"new": "new-secret", **auth.SIGNING_KEYS})
+    new_token = test_login(client)
+    assert auth.jwt.get_unverified_header(new_token)["kid"] == "new"
+    for token in (old_token, new_token):
+        response = client.post("/comments/", json={"movie_id": 1, "comment": "Still valid"}, headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 201
+
+    # Once the old key is retired its tokens are rejected
+    monkeypatch.setattr(auth, "SIGNING_KEYS", {"new": "new-secret"})
+    response = client.post("/comments/", json={"movie_id": 1, "comment": "Too old"}, headers={"Authorization": f"Bearer {old_token}"})
+    assert response.status_code == 401
+
+def test_logout(client):
+    token = test_login(client)
+    other_token = test_login(client)
+
+    response = client.post("/logout", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 204
+
+    response = client.post("/ratings/", json={"movie_id": 1, "rating": 4}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 401
+
+    # Only the logged out token is revoked
+    response = client.post("/ratings/", json={"movie_id": 1, "rating": 4}, headers={"Authorization": f"Bearer {other_token}"})
+    assert response.status_code == 201
+
+def test_logout_everywhere(client):
+    import app.auth as auth
+    token = test_login(client)
+    other_token = test_login(client)
+
+    response = client.post("/logout/all", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 204
+
+    # A fresh reload from the database must agree with the in-memory list
+    auth.revocation_list.clear()
+    for revoked in (token, other_token):
+        response = client.post("/ratings/", json={"movie_id": 1, "rating": 4}, headers={"Authorization": f"Bearer {revoked}"})
+        assert response.status_code == 401
+
+    response = client.post("/ratings/", json={"movie_id": 1, "rating": 4}, headers={"Authorization": f"Bearer {test_login(client)}"})
+    assert response.status_code == 201
+
+def test_revocation_refresh_keeps_concurrent_revokes(monkeypatch):
+    import app.auth as auth
+    revocations = auth.RevocationList()
+    revocations.revoke("old")
+
+    def stale_read(db, now):
+        # A logout commits and updates the list while the reload's read is running
+        revocations.revoke("new")
+        revocations.set_version(7, 2)
+        return ["old"], {7: 1}
+
+    monkeypatch.setattr(auth.crud, "get_revocations", stale_read)
+    revocations.refresh_if_stale(None)
+    assert revocations.is_revoked("new", 1, 0)
+    assert revocations.is_revoked("any", 7, 1)
+    assert not revocations.is_stale()
+
+    # Stale callers do not pile up on the database while a reload runs
+    revocations.loaded_at = 0
+    with revocations._refresh_lock:
+        revocations.refresh_if_stale(None)
+    assert revocations.loaded_at == 0
+
+def test_similar_movies_and_recommendations(client):
+    from app.recommender import recommender
+    movie_ids = [test_create_movie(client) for _ in range(3)]
+
+    # Two other users like the first two movies and dislike the third
+    for username in ("fan1", "fan2"):
+        client.post("/signup", json={"username": username, "email": f"{username}@example.com", "password": "testpassword"})
+        token = client.post("/token", data={"username": username, "password": "testpassword"}).json()["access_token"]
+        for movie_id, rating in zip(movie_ids, (5, 5, 1)):
+            client.post("/ratings/", json={"movie_id": movie_id, "rating": rating}, headers={"Authorization": f"Bearer {token}"})
+    recommender.clear()
+
+    response = client.get(f"/movie/{movie_ids[0]}/similar")
+    assert response.status_code == 200
+    data = response.json()
+    assert data[0]["movie"]["id"] == movie_ids[1]
+    assert movie_ids[2] not in [item["movie"]["id"] for item in data]
+
+    response = client.get("/movie/999999/similar")
+    assert response.status_code == 404
+
+    # A user who rated the first movie highly and the third poorly gets the second one
+    fan3 = client.post("/signup", json={"username": "fan3", "email": "fan3@example.com", "password": "testpassword"})
+    assert fan3.status_code == 201
+    token = client.post("/token", data={"username": "fan3", "password": "testpassword"}).json()["access_token"]
+    client.post("/ratings/", json={"movie_id": movie_ids[0], "rating": 5}, headers={"Authorization": f"Bearer {token}"})
+    response = client.post("/ratings/", json={"movie_id": movie_ids[2], "rating": 1}, headers={"Authorization": f"Bearer {token}"})
+    user_id = response.json()["user_id"]
+    recommender.clear()
+
+    response = client.get(f"/users/{user_id}/recommendations")
+    assert response.status_code == 200
+    data = response.json()
+    assert data[0]["movie"]["id"] == movie_ids[1]
+    assert not {movie_ids[0], movie_ids[2]} & {item["movie"]["id"] for item in data}
+
+    response = client.get("/users/999999/recommendations")
+    assert response.status_code == 404
+    for limit in (0, -1, 10_000):
+        assert client.get(f"/movie/{movie_ids[0]}/similar?limit={limit}").status_code == 422
+        assert client.get(f"/users/{user_id}/recommendations?limit={limit}").status_code == 422
+
+def test_recommender_rebuilds_in_background(test_db, monkeypatch):
+    import threading
+    import app.recommender as rec
+    # Small chunks so loading goes through several partitions
+    monkeypatch.setattr(rec, "LOAD_CHUNK_ROWS", 2)
+    expected = rec.SimilarityModel.from_db(test_db)
+    assert len(expected.movie_ids) > 2
+
+    release = threading.Event()
+    def session_factory():
+        release.wait(5)
+        return TestingSessionLocal()
+
+    recommender = rec.Recommender(refresh_seconds=60, session_factory=session_factory)
+    recommender.refresh(test_db)
+    old_model = recommender.model
+    recommender.built_at -= 60
+
+    # A stale model is served at once while the rebuild waits on its session
+    assert recommender.get_model(test_db) is old_model
+    assert recommender.get_model(test_db) is old_model
+    release.set()
+    with recommender._lock:
+        pass
+    assert recommender.model is not old_model
+    assert recommender.model.movie_ids.tolist() == expected.movie_ids.tolist()
+    assert not recommender.is_stale()
+
+def test_movie_events_stream(client, monkeypatch):
+    import asyncio
+    import json
+    import threading
+    import app.events as events
+    broker = events.OutboxBroker(TestingSessionLocal, poll_seconds=0.05)
+    monkeypatch.setattr(events, "broker", broker)
+    # subscribe() queries the database, so it must run off the event loop
+    on_loop = []
+    subscribe = broker.subscribe
+    def checked_subscribe(*args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return subscribe(*args, **kwargs)
+    monkeypatch.setattr(broker, "subscribe", checked_subscribe)
+    monkeypatch.setattr(events, "SSE_STREAM_SECONDS", 0.5)
+    token = test_login(client)
+    movie_id = test_create_movie(client)
+
+    def read_events(headers=None):
+        response = client.get(f"/movie/{movie_id}/events", headers=headers or {})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        frames = [frame for frame in response.text.split("\n\n") if frame.startswith("id:")]
+        return [dict(line.split(": ", 1) for line in frame.split("\n")) for frame in frames]
+
+    comment = client.post("/comments/", json={"movie_id": movie_id, "comment": "Live!"}, headers={"Authorization": f"Bearer {token}"}).json()
+    client.post("/comments/reply/", json={"comment_id": comment["id"], "comment": "Agreed"}, headers={"Authorization": f"Bearer {token}"})
+    client.post("/ratings/", json={"movie_id": movie_id, "rating": 3}, headers={"Authorization": f"Bearer {token}"})
+
+    # Resuming from the start replays everything in order
+    replayed = read_events({"Last-Event-ID": "0"})
+    assert [event["event"] for event in replayed] == ["comment", "reply", "rating"]
+    assert json.loads(replayed[0]["data"])["comment"] == "Live!"
+    assert json.loads(replayed[2]["data"])["rating"] == 3
+
+    # Resuming from an id only sends what came after it
+    resumed = read_events({"Last-Event-ID": replayed[0]["id"]})
+    assert [event["id"] for event in resumed] == [event["id"] for event in replayed[1:]]
+
+    # Without Last-Event-ID only new events are pushed, including ones published from another thread
+    timer = threading.Timer(0.1, broker.publish, (movie_id, "comment", {"comment": "From a worker thread"}))
+    timer.start()
+    live = read_events()
+    timer.join()
+    assert [json.loads(event["data"]) for event in live] == [{"comment": "From a worker thread"}]
+
+    response = client.get("/movie/999999/events")
+    assert response.status_code == 404
+    assert on_loop and not any(on_loop)
+    broker.close()
+
+def test_write_and_event_commit_together(client, test_db, monkeypatch):
+    from sqlalchemy.exc import IntegrityError
+    import app.events as events
+    import app.models as models
+    token = test_login(client)
+    movie_id = test_create_movie(client)
+    record = events.record
+    def broken_record(db, movie_id, event_type, data):
+        row = record(db, movie_id, event_type, data)
+        row.data = None  # violates NOT NULL when the transaction commits
+        return row
+    monkeypatch.setattr(events, "record", broken_record)
+
+    # When the event cannot be stored, neither is the rating it describes
+    with pytest.raises(IntegrityError):
+        client.post("/ratings/", json={"movie_id": movie_id, "rating": 2}, headers={"Authorization": f"Bearer {token}"})
+    test_db.rollback()
+    assert test_db.query(models.Rating).filter_by(movie_id=movie_id).count() == 0
+
+    monkeypatch.setattr(events, "record", record)
+    client.post("/ratings/", json={"movie_id": movie_id, "rating": 2}, headers={"Authorization": f"Bearer {token}"})
+    assert test_db.query(models.MovieEvent).filter_by(movie_id=movie_id, type="rating").count() == 1
+
+def test_outbox_brokers_share_events(tmp_path):
+    import asyncio
+    import app.events as events
+    engine = create_engine(f"sqlite:///{tmp_path / 'events.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    # Two brokers on one database stand in for two gunicorn workers; the
+    # test polls by hand
+    first, second = (events.OutboxBroker(session_factory, poll_seconds=60) for _ in range(2))
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        on_first, on_second = first.subscribe(1, loop), second.subscribe(1, loop)
+        published = [
+            first.publish(1, "comment", {"comment": "From the first worker"}),
+            second.publish(1, "rating", {"rating": 4}),
+            first.publish(2, "comment", {"comment": "Other movie"}),
+        ]
+        # Ids are ordered across both brokers
+        assert [event.id for event in published] == sorted(event.id for event in published)
+
+        first.poll()
+        second.poll()
+        for subscription in (on_first, on_second):
+            assert [event.id for event in subscription.drain()] == [published[0].id, published[1].id]
+
+        # A client that saw only the first event resumes on the other worker
+        later = first.publish(1, "reply", {"comment": "Resumed"})
+        resumed = second.subscribe(1, loop, last_event_id=published[0].id)
+        second.poll()
+        assert [(event.id, event.type) for event in resumed.drain()] == [(published[1].id, "rating"), (later.id, "reply")]
+        for subscription in (on_first, on_second, resumed):
+            subscription.close()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        first.close()
+        second.close()
+
+def test_outbox_ids_survive_pruning(tmp_path, monkeypatch):
+    import asyncio
+    import app.events as events
+    engine = create_engine(f"sqlite:///{tmp_path / 'events.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    broker = events.OutboxBroker(sessionmaker(bind=engine), poll_seconds=60)
+
+    async def scenario():
+        subscription = broker.subscribe(1, asyncio.get_running_loop())
+        old = [broker.publish(1, "comment", {"n": n}) for n in range(3)]
+        broker.poll()
+        assert [event.id for event in subscription.drain()] == [event.id for event in old]
+
+        # Nothing published for the whole retention period: pruning empties the table
+        monkeypatch.setattr(events, "SSE_RETENTION_SECONDS", 0)
+        broker._pruned_at = 0
+        broker.poll()
+        new = broker.publish(1, "comment", {"n": 3})
+        assert new.id > old[-1].id
+        broker.poll()
+        assert [event.id for event in subscription.drain()] == [new.id]
+        subscription.close()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        broker.close()
+
+def test_idempotency_key_replays_response(client):
+    import app.idempotency as idempotency
+    token = test_login(client)
+    movie_id = test_create_movie(client)
+    headers = {"Authorization": f"Bearer {token}", "Idempotency-Key": "retry-comment-1"}
+
+    first = client.post("/comments/", json={"movie_id": movie_id, "comment": "Only once"}, headers=headers)
+    assert first.status_code == 201
+    retry = client.post("/comments/", json={"movie_id": movie_id, "comment": "Only once"}, headers=headers)
+    assert retry.status_code == 201
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+    # The key survives losing the in-memory map (another worker, a restart)
+    idempotency.store.clear()
+    retry = client.post("/comments/", json={"movie_id": movie_id, "comment": "Only once"}, headers=headers)
+    assert retry.json() == first.json()
+
+    comments = client.get(f"/comments/?movie_id={movie_id}").json()
+    assert [comment["comment"] for comment in comments] == ["Only once"]
+
+    # Reusing the key for a different request is an error
+    response = client.post("/comments/", json={"movie_id": movie_id, "comment": "Something else"}, headers=headers)
+    assert response.status_code == 422
+
+    # Keys the table cannot hold are rejected before anything is written
+    for bad_key in ("", "k" * 256):
+        response = client.post("/comments/", json={"movie_id": movie_id, "comment": "Bad key"}, headers={**headers, "Idempotency-Key": bad_key})
+        assert response.status_code == 422
+    assert len(client.get(f"/comments/?movie_id={movie_id}").json()) == 1
+
+def test_idempotency_key_released_on_failure(client):
+    token = test_login(client)
+    headers = {"Authorization": f"Bearer {token}", "Idempotency-Key": "retry-rating-1"}
+
+    response = client.post("/ratings/", json={"movie_id": 999999, "rating": 4}, headers=headers)
+    assert response.status_code == 404
+
+    # A failed request does not burn the key
+    movie_id = test_create_movie(client)
+    response = client.post("/ratings/", json={"movie_id": movie_id, "rating": 4}, headers=headers)
+    assert response.status_code == 201
+    response = client.post("/movie/", json={"title": "Retried", "author": "Someone", "release_date": "2020-01-01"}, headers=headers)
+    assert response.status_code == 422
+
+def test_idempotency_claims_lease_and_prune(test_db, count_queries):
+    from datetime import datetime, timedelta
+    from fastapi import HTTPException
+    import app.idempotency as idempotency
+    import app.models as models
+    store = idempotency.IdempotencyStore(ttl_seconds=3600, lease_seconds=60)
+    user_id = test_db.query(models.User.id).first()[0]
+    def claim_row(key):
+        return test_db.query(models.IdempotencyKey).filter_by(user_id=user_id, key=key).one()
+
+    # A request that died mid-write leaves an unfinished claim behind
+    test_db.add(models.IdempotencyKey(user_id=user_id, key="crashed", fingerprint="f", created_at=datetime.utcnow()))
+    test_db.commit()
+    with pytest.raises(HTTPException) as conflict:
+        store.run(test_db, user_id, "crashed", "f", 201, lambda: {"n": 1})
+    assert conflict.value.status_code == 409
+    # Once its lease is up the retry takes the key over
+    claim_row("crashed").created_at -= timedelta(seconds=61)
+    test_db.commit()
+    assert store.run(test_db, user_id, "crashed", "f", 201, lambda: {"n": 2}).body == b'{"n":2}'
+
+    # A replay missing the in-memory map is answered by a single SELECT
+    store.clear()
+    with count_queries() as queries:
+        response = store.run(test_db, user_id, "crashed", "f", 201, lambda: {"n": 3})
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert queries.count == 1, queries
+
+    # Expired keys are deleted by the next claim once the prune interval is up
+    claim_row("crashed").created_at -= timedelta(hours=2)
+    test_db.commit()
+    store._pruned_at -= store.prune_seconds
+    store.run(test_db, user_id, "fresh", "g", 201, lambda: {"n": 4})
+    keys = {key for (key,) in test_db.query(models.IdempotencyKey.key).filter_by(user_id=user_id)}
+    assert "crashed" not in keys and "fresh" in keys
+
+def test_export_movies(client):
+    import csv
+    import gzip
+    import io
+    import json
+    from datetime import datetime, timedelta
+    token = test_login(client)
+    movie_id = test_create_movie(client)
+    for rating in (3, 5):
+        client.post("/ratings/", json={"movie_id": movie_id, "rating": rating}, headers={"Authorization": f"Bearer {token}"})
+
+    response = client.get("/export/movies")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == sorted(row["id"] for row in rows)
+    exported = next(row for row in rows if row["id"] == movie_id)
+    assert exported["ratings_count"] == 2
+    assert exported["average_rating"] == 4.0
+    assert exported["comments_count"] == 0
+
+    response = client.get("/export/movies?format=csv")
+    assert response.status_code == 200
+    reader = csv.DictReader(io.StringIO(gzip.decompress(response.content).decode()))
+    assert len(list(reader)) == len(rows)
+
+    # A comment bumps updated_at, so an incremental export picks the movie up again
+    since = exported["updated_at"]
+    client.post("/comments/", json={"movie_id": movie_id, "comment": "Exported"}, headers={"Authorization": f"Bearer {token}"})
+    response = client.get("/export/movies", params={"since": since})
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == [movie_id]
+    assert rows[0]["comments_count"] == 1
+
+    # since is inclusive: the last updated_at a client saw is sent again
+    response = client.get("/export/movies", params={"since": rows[0]["updated_at"]})
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [movie_id]
+
+    future = (datetime.utcnow() + timedelta(days=1)).isoformat()
+    response = client.get("/export/movies", params={"since": future})
+    assert response.text == ""
+
+# Most SQL statements each endpoint may run. Raise a budget only with a reason:
+# a higher count usually means a new lazy load or a redundant lookup. Writes that
+# publish a movie event include its INSERT into the movie_events outbox, made in
+# the same transaction. Keys are
+# "METHOD path" as routed, optionally followed by a variant in parentheses.
+QUERY_BUDGETS = {
+    "GET /": 0,
+    "POST /signup": 3,
+    "POST /token": 1,
+    "GET /movies/": 1,
+    "GET /movies/ (include)": 1,
+    "GET /movies/batch": 1,
+    "GET /movie/{movie_id}": 1,
+    "GET /movie/{movie_id}/similar": 2,
+    "GET /movie/{movie_id}/events": 2,
+    "GET /users/{user_id}/recommendations": 2,
+    "GET /ratings/": 1,
+    "GET /comments/": 1,
+    "POST /movie/": 2,
+    "PUT /movies/{movie_id}": 3,
+    "POST /ratings/": 4,
+    "POST /comments/": 4,
+    "POST /comments/ (replayed Idempotency-Key)": 0,
+    "POST /comments/reply/": 5,
+    "DELETE /movies/{movie_id}": 4,
+    "GET /export/movies": 1,
+    "POST /logout": 1,
+    "POST /logout/all": 2,
+}
+
+def test_query_budgets(client, test_db, count_queries, monkeypatch):
+    from fastapi.routing import APIRoute
+    import app.auth as auth
+    import app.events as events
+    from app.recommender import recommender
+    # Every route has a budget, so a new endpoint cannot be missed
+    routes = {f"{method} {route.path}" for route in app.routes if isinstance(route, APIRoute) for method in route.methods}
+    assert {name.split(" (")[0] for name in QUERY_BUDGETS} == routes
+
+    # The stream ends at once, and the broker's poller stays idle so it does not add to the counts
+    broker = events.OutboxBroker(TestingSessionLocal, poll_seconds=3600)
+    monkeypatch.setattr(events, "broker", broker)
+    monkeypatch.setattr(events, "SSE_STREAM_SECONDS", 0)
+    token = test_login(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    movie_id = test_create_movie(client)
+    comment_id = client.post("/comments/", json={"movie_id": movie_id, "comment": "Budget"}, headers=headers).json()["id"]
+    user_id = client.post("/ratings/", json={"movie_id": movie_id, "rating": 4}, headers=headers).json()["user_id"]
+    client.post("/comments/", json={"movie_id": movie_id, "comment": "Once"}, headers={**headers, "Idempotency-Key": "budget"})
+    doomed_movie_id = test_create_movie(client)
+    logout_token = test_login(client)
+    client.post("/signup", json={"username": "budget", "email": "budget@example.com", "password": "testpassword"})
+    logout_all_token = client.post("/token", data={"username": "budget", "password": "testpassword"}).json()["access_token"]
+
+    requests = {
+        "GET /": lambda: client.get("/"),
+        "POST /signup": lambda: client.post("/signup", json={"username": "budget2", "email": "budget2@example.com", "password": "testpassword"}),
+        "POST /token": lambda: client.post("/token", data={"username": "testuser", "password": "testpassword"}),
+        "GET /movies/": lambda: client.get("/movies/"),
+        "GET /movies/ (include)": lambda: client.get("/movies/?fields=id,title&include=stats,comments_count"),
+        "GET /movies/batch": lambda: client.get(f"/movies/batch?ids={movie_id},1,2"),
+        "GET /movie/{movie_id}": lambda: client.get(f"/movie/{movie_id}"),
+        "GET /movie/{movie_id}/similar": lambda: client.get(f"/movie/{movie_id}/similar"),
+        "GET /movie/{movie_id}/events": lambda: client.get(f"/movie/{movie_id}/events"),
+        "GET /users/{user_id}/recommendations": lambda: client.get(f"/users/{user_id}/recommendations"),
+        "GET /ratings/": lambda: client.get(f"/ratings/?movie_id={movie_id}"),
+        "GET /comments/": lambda: client.get(f"/comments/?movie_id={movie_id}"),
+        "POST /movie/": lambda: client.post("/movie/", json={"title": "Budget", "author": "Author", "release_date": "2020-01-01"}, headers=headers),
+        "PUT /movies/{movie_id}": lambda: client.put(f"/movies/{movie_id}", json={"title": "Budget", "author": "Author", "release_date": "2020-01-01"}, headers=headers),
+        "POST /ratings/": lambda: client.post("/ratings/", json={"movie_id": movie_id, "rating": 5}, headers=headers),
+        "POST /comments/": lambda: client.post("/comments/", json={"movie_id": movie_id, "comment": "Budget"}, headers=headers),
+        "POST /comments/ (replayed Idempotency-Key)": lambda: client.post("/comments/", json={"movie_id": movie_id, "comment": "Once"}, headers={**headers, "Idempotency-Key": "budget"}),
+        "POST /comments/reply/": lambda: client.post("/comments/reply/", json={"comment_id": comment_id, "comment": "Budget"}, headers=headers),
+        "DELETE /movies/{movie_id}": lambda: client.delete(f"/movies/{doomed_movie_id}", headers=headers),
+        "GET /export/movies": lambda: client.get("/export/movies"),
+        "POST /logout": lambda: client.post("/logout", headers={"Authorization": f"Bearer {logout_token}"}),
+        "POST /logout/all": lambda: client.post("/logout/all", headers={"Authorization": f"Bearer {logout_all_token}"}),
+    }
+    assert set(requests) == set(QUERY_BUDGETS)
+
+    for name, send in requests.items():
+        # Keep the periodic reloads out of the count
+        auth.revocation_list.refresh(test_db)
+        recommender.refresh(test_db)
+        with count_queries() as queries:
+            response = send()
+        assert response.status_code < 400, (name, response.text)
+        assert queries.count <= QUERY_BUDGETS[name], f"{name} is over budget: {queries}"
+    broker.close()
+
+def test_lazy_loads_raise(test_db):
+    import app.models as models
+    movie = test_db.query(models.Movie).first()
+    with pytest.raises(Exception, match="lazy='raise'"):
+        movie.ratings
+
+def test_sqlite_profile(tmp_path):
+    import threading
+    from sqlalchemy import select, text, update
+    from sqlalchemy.orm import sessionmaker
+    import app.database as database
+    import app.models as models
+    writer, reader = database.create_sqlite_engines(f"sqlite:///{tmp_path / 'profile.db'}")
+    database.Base.metadata.create_all(writer)
+
+    with reader.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == database.SQLITE_BUSY_TIMEOUT_MS
+
+    ProfileSession = sessionmaker(bind=writer, class_=database.RoutingSession, info={"read_engine": reader}, autoflush=False)
+    db = ProfileSession()
+    assert db.get_bind(clause=select(models.Movie)) is reader
+    assert db.get_bind(clause=update(models.Movie)) is writer
+    db.add(models.User(username="sqlite", email="sqlite@example.com", hashed_password="x"))
+    db.commit()
+    user_id = db.query(models.User.id).scalar()
+    db.close()
+
+    # Concurrent writers queue on the single writer connection instead of failing
+    errors = []
+    def write_movies():
+        session = ProfileSession()
+        try:
+            for i in range(20):
+                session.add(models.Movie(title=f"Movie {i}", author="Author", created_by=user_id))
+                session.commit()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            session.close()
+    threads = [threading.Thread(target=write_movies) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    db = ProfileSession()
+    assert db.query(models.Movie).count() == 160
+    db.close()
+    writer.dispose()
+    reader.dispose()
+
+def test_endpoints_through_routing_session(client, monkeypatch):
+    from sqlalchemy import event
+    import app.database as database
+    import app.events as events
+    if not issubclass(database.SessionLocal.class_, database.RoutingSession):
+        pytest.skip("URL_DATABASE is not a SQLite file")
+    monkeypatch.setattr(events, "broker", events.OutboxBroker(database.SessionLocal, poll_seconds=3600))
+    # Use the app's own get_db, and so SessionLocal, instead of the test session
+    monkeypatch.delitem(app.dependency_overrides, get_db)
+
+    statements = {"writer": [], "reader": []}
+    def recorder(name):
+        return lambda conn, cursor, statement, *args: statements[name].append(statement.split()[0])
+    listeners = [(database.engine, recorder("writer")), (database.read_engine, recorder("reader"))]
+    for engine_, listener in listeners:
+        event.listen(engine_, "before_cursor_execute", listener)
+    try:
+        token = test_login(client)
+        movie_id = test_create_movie(client)
+        response = client.post("/ratings/", json={"movie_id": movie_id, "rating": 4}, headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 201
+        response = client.get(f"/movie/{movie_id}")
+        assert response.status_code == 200 and response.json()["title"] == "Inception"
+        assert client.get(f"/ratings/?movie_id={movie_id}").json()[0]["rating"] == 4
+    finally:
+        for engine_, listener in listeners:
+            event.remove(engine_, "before_cursor_execute", listener)
+
+    # Writes went through the single writer connection, plain reads through the pool
+    assert {"INSERT", "UPDATE"} <= set(statements["writer"])
+    assert set(statements["reader"]) == {"SELECT"}
+
+# Schema written by Base.metadata.create_all before migrations existed
+BASELINE_SCHEMA = [
+    "CREATE TABLE users (id INTEGER NOT NULL PRIMARY KEY, username VARCHAR(15) NOT NULL UNIQUE, email VARCHAR(50) NOT NULL UNIQUE, hashed_password VARCHAR(500) NOT NULL)",
+    "CREATE TABLE movies (id INTEGER NOT NULL PRIMARY KEY, title VARCHAR(50) NOT NULL, author VARCHAR(50) NOT NULL, release_date DATE, created_by INTEGER NOT NULL REFERENCES users (id))",
+    "CREATE TABLE ratings (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id), movie_id INTEGER NOT NULL REFERENCES movies (id), rating INTEGER NOT NULL)",
+    "CREATE TABLE comments (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id), movie_id INTEGER NOT NULL REFERENCES movies (id), comment VARCHAR(500) NOT NULL, parent_id INTEGER REFERENCES comments (id))",
+    *(f"CREATE UNIQUE INDEX ix_{table}_id ON {table} (id)" for table in ("users", "movies", "ratings", "comments")),
+    "INSERT INTO users (id, username, email, hashed_password) VALUES (1, 'old', 'old@example.com', 'x')",
+    "INSERT INTO movies (id, title, author, release_date, created_by) VALUES (1, 'Old', 'Author', '2020-01-01', 1)",
+]
+
+def test_migrations_upgrade_baseline_database(tmp_path):
+    from alembic import command
+    from alembic.config import Config
+    from sqlalchemy import inspect, text
+    from sqlalchemy.orm import Session
+    import app.models as models
+    baseline_engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with baseline_engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.execute(text(statement))
+
+    config = Config("alembic.ini")
+    with baseline_engine.begin() as connection:
+        config.attributes["connection"] = connection
+        command.upgrade(config, "head")
+
+    # The migrated tables match the models, and existing rows load through the ORM
+    inspector = inspect(baseline_engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        assert {column.name for column in table.columns} <= columns, table.name
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        assert {index.name for index in table.indexes} <= indexes, table.name
+    assert not next(column for column in inspector.get_columns("movies") if column["name"] == "updated_at")["nullable"]
+    with Session(baseline_engine) as db:
+        assert db.query(models.User).one().token_version == 0
+        movie = db.query(models.Movie).one()
+        assert movie.title == "Old" and movie.updated_at is not None